@@ -1,17 +1,26 @@
 from __future__ import annotations
-import os, random, json
+import os, random, json, threading, time, csv, io, queue, atexit, math, logging
+from collections import OrderedDict, namedtuple
+from bisect import bisect_left
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+import click
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, flash, session, g, has_request_context, jsonify, Response, before_render_template, template_rendered
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, FloatField, IntegerField, FileField
-from wtforms.validators import DataRequired, Email, Length, NumberRange
+from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, ForeignKey, Text
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship, scoped_session
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, Float, ForeignKey, Text, UniqueConstraint, Index, func, case, insert, update, select, text, tuple_, or_, and_, bindparam, literal
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, scoped_session, joinedload
 
 SITE_NAME = "BETA BLOCKZ"
 INVITE_CODE = "DUKESLOVESCURRY"
 HOUSE_EDGE = 0.10
+AUTOBET_MAX = 10000  # rounds per auto-bet request
 
 BETA_PER_SOL = 100.0
 def sol_to_beta(sol: float) -> float: return float(sol or 0.0) * BETA_PER_SOL
@@ -51,18 +60,71 @@ def vip_progress(total_wagered_sol: float):
 ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL", "admin@betablockz.local")
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "admin123")
 SECRET_KEY = os.environ.get("SECRET_KEY", "change-this-secret-key")
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "0"))  # seconds; 0 disables the cross-request user cache
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1024"))
+ADMIN_PAGE_SIZE = 50
+MINES_ROUND_TTL = float(os.environ.get("MINES_ROUND_TTL", "600"))  # seconds idle before an open Mines round is cashed out
+MINES_ROUND_MAX = int(os.environ.get("MINES_ROUND_MAX", "10000"))  # open rounds held per process
+LEDGER_WRITER = os.environ.get("LEDGER_WRITER", "0") == "1"  # group-commit bet settlements from a background writer
+LEDGER_FLUSH_MS = float(os.environ.get("LEDGER_FLUSH_MS", "5"))
+LEDGER_FLUSH_MAX = int(os.environ.get("LEDGER_FLUSH_MAX", "500"))
+LEDGER_RESULT_TIMEOUT = float(os.environ.get("LEDGER_RESULT_TIMEOUT", "30"))  # seconds a bet waits for its batch before failing
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))  # log slower requests with their SQL; 0 = off
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "90"))  # settled transactions older than this move to the archive
 
-app = Flask(__name__)
-app.config["SECRET_KEY"] = SECRET_KEY
-# --- TEMP: make login/forms work in hosted envs ---
-app.config["WTF_CSRF_ENABLED"] = False     # disable CSRF just to confirm the issue
-app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
-app.config["SESSION_COOKIE_SECURE"] = False
-# --------------------------------------------------
-app.jinja_env.globals.update(fmt_beta=fmt_beta, vip_progress=vip_progress)
-
-engine = create_engine("sqlite:///beta_blockz.db", connect_args={"check_same_thread": False})
-SessionLocal = scoped_session(sessionmaker(bind=engine))
+# Database: SQLite by default; set DATABASE_URL (e.g. postgresql+psycopg://user:pw@host/db) for a server database.
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///beta_blockz.db")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+AUTO_INIT_DB = os.environ.get("AUTO_INIT_DB", "1") == "1"  # create schema / seed admin on first request; 0 = run `flask init-db` at deploy
+
+# Routes, hooks and CLI commands live on this blueprint; create_app() (bottom of file) builds the app around it
+bp = Blueprint("site", __name__, cli_group=None)
+
+def normalize_db_url(url: str) -> str: return "postgresql://" + url[len("postgres://"):] if url.startswith("postgres://") else url
+
+def make_engine(url: str):
+    """Engine for url. SQLite connections get WAL journaling (readers don't block the writer),
+    synchronous=NORMAL, a busy timeout and mmap; server databases get a sized, pre-pinged pool."""
+    url = normalize_db_url(url)
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=DB_POOL_PRE_PING, pool_recycle=DB_POOL_RECYCLE)
+    eng = create_engine(url, connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0})
+    @event.listens_for(eng, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cur.close()
+    return eng
+
+def dialect_insert(bind):
+    """INSERT construct with ON CONFLICT support for the connected backend (SQLite or PostgreSQL)."""
+    return pg_insert if bind.dialect.name == "postgresql" else sqlite_insert
+
+engine = None  # set by init_engine(); nothing connects until the first query
+SessionLocal = scoped_session(sessionmaker())
+
+def init_engine(url: str):
+    """Create the engine for url, instrument it for /metrics and bind SessionLocal to it.
+
+    SessionLocal, the caches and the ledger writer are per process, so a process serves one database:
+    later calls for the same URL reuse the engine and a different URL is refused rather than silently
+    moving apps built earlier onto it.
+    """
+    global engine
+    if engine is not None:
+        if engine.url == make_url(normalize_db_url(url)): return engine
+        raise RuntimeError(f"This process is already bound to {engine.url!r}; set DATABASE_URL before importing app to use {make_url(url)!r}.")
+    engine = make_engine(url); instrument_engine(engine)
+    SessionLocal.remove(); SessionLocal.configure(bind=engine)
+    return engine
 Base = declarative_base()
 
 class User(Base):
@@ -82,6 +144,7 @@ class User(Base):
     role = Column(String, default="user")
     created_at = Column(DateTime, default=datetime.utcnow)
     txns = relationship("Transaction", back_populates="user")
+    __table_args__ = (Index("ix_users_created_id", "created_at", "id"),)
 
 class Transaction(Base):
     __tablename__ = "transactions"
@@ -93,6 +156,41 @@ class Transaction(Base):
     status = Column(String, default="completed")
     created_at = Column(DateTime, default=datetime.utcnow)
     user = relationship("User", back_populates="txns")
+    __table_args__ = (
+        Index("ix_transactions_user_created", "user_id", "created_at"),
+        Index("ix_transactions_user_type_created", "user_id", "type", "created_at"),
+        Index("ix_transactions_status_created", "status", "created_at"),
+    )
+
+class TransactionArchive(Base):
+    # Cold store: settled transactions moved out of `transactions` by archive-transactions, ids kept
+    __tablename__ = "transactions_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    type = Column(String)
+    amount = Column(Float, default=0.0)
+    meta = Column(Text)
+    status = Column(String)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_transactions_archive_user_created", "user_id", "created_at"),
+        Index("ix_transactions_archive_user_type_created", "user_id", "type", "created_at"),
+    )
+
+class ArchiveTotal(Base):
+    # Per-user, per-type totals of everything archived so far
+    __tablename__ = "archive_totals"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    type = Column(String, nullable=False)
+    txns = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False, default=0.0)
+    through = Column(DateTime, nullable=True)  # newest created_at archived
+    __table_args__ = (UniqueConstraint("user_id", "type", name="uq_archive_totals_user_type"),)
+
+# Every ledger read that spans history goes over both stores, oldest store first
+LEDGER_MODELS = (TransactionArchive, Transaction)
 
 class WalletPool(Base):
     __tablename__ = "wallet_pool"
@@ -100,15 +198,144 @@ class WalletPool(Base):
     address = Column(String, unique=True, nullable=False)
     assigned_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     assigned_at = Column(DateTime, nullable=True)
+    __table_args__ = (Index("ix_wallet_pool_assigned_id", "assigned_user_id", "id"),)
+
+class WagerRollup(Base):
+    # One row per user, game and hour; updated as bets settle, rebuilt by `flask backfill-rollups`
+    __tablename__ = "wager_rollups"
+    __table_args__ = (UniqueConstraint("user_id", "game", "bucket", name="uq_wager_rollups_user_game_bucket"),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    game = Column(String, nullable=False)
+    bucket = Column(DateTime, nullable=False)
+    bets = Column(Integer, default=0)
+    wagered = Column(Float, default=0.0)
+    pnl = Column(Float, default=0.0)
+
+class BetRecord(Base):
+    # Typed copy of each settled bet for SQL analytics; an auto-bet run is one row covering `rounds` rounds
+    __tablename__ = "bets"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    game = Column(String, nullable=False)
+    rounds = Column(Integer, nullable=False, default=1)
+    wins = Column(Integer, nullable=False, default=0)
+    bet = Column(Float, nullable=False)
+    payout = Column(Float, nullable=False, default=0.0)
+    mult = Column(Float, nullable=True)
+    roll = Column(Integer, nullable=True)
+    target = Column(Integer, nullable=True)
+    mines = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_bets_created_game", "created_at", "game"),
+        Index("ix_bets_user_created", "user_id", "created_at"),
+    )
+
+class AutoBetRun(Base):
+    # Per-round outcomes of an auto-bet run, kept out of the ledger meta that pages render
+    __tablename__ = "autobet_runs"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    game = Column(String, nullable=False)
+    rounds = Column(Integer, nullable=False)
+    outcomes = Column(Text, nullable=False)  # dice: comma-separated rolls; mines: one 1/0 per pick
+    created_at = Column(DateTime, nullable=False)  # same as the run's ledger pair
+    __table_args__ = (Index("ix_autobet_runs_user_created", "user_id", "created_at"),)
+
+class MinesRound(Base):
+    # A multi-step Mines round. Written when it starts (stake debited) and when it ends; reveals live in memory
+    __tablename__ = "mines_rounds"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    bet = Column(Float, nullable=False)
+    mines = Column(Integer, nullable=False)
+    board = Column(String, nullable=False)  # mine tiles, comma-separated 0-24
+    status = Column(String, nullable=False, default="open")  # open / cashed / bust / void
+    reveals = Column(String, nullable=True)  # safe tiles opened, in order; set at close
+    payout = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    closed_at = Column(DateTime, nullable=True)  # set once settled; an outcome without it is still owed
+    __table_args__ = (
+        Index("ix_mines_rounds_user_unsettled", "user_id", sqlite_where=text("closed_at IS NULL"), postgresql_where=text("closed_at IS NULL")),
+        Index("uq_mines_rounds_user_open", "user_id", unique=True, sqlite_where=text("status = 'open'"), postgresql_where=text("status = 'open'")),
+    )
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+# Versioned schema changes for databases created before the models declared them.
+# create_all() only creates missing tables; anything touching an existing table goes here.
+# Append only; never edit a migration that has shipped.
+MIGRATIONS = [
+    (1, "transaction and wallet pool indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_transactions_user_created ON transactions (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_user_type_created ON transactions (user_id, type, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_status_created ON transactions (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_wallet_pool_assigned_id ON wallet_pool (assigned_user_id, id)",
+    ]),
+    (2, "users keyset index", [
+        "CREATE INDEX IF NOT EXISTS ix_users_created_id ON users (created_at, id)",
+    ]),
+    (3, "unsettled mines rounds index", [
+        "CREATE INDEX IF NOT EXISTS ix_mines_rounds_user_unsettled ON mines_rounds (user_id) WHERE closed_at IS NULL",
+    ]),
+]
 
-Base.metadata.create_all(engine)
+def run_migrations(bind) -> list:
+    """Apply pending MIGRATIONS in order, each in its own transaction. Returns the versions applied."""
+    with bind.connect() as conn:
+        done = set(conn.execute(select(SchemaMigration.version)).scalars())
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if version in done: continue
+        try:
+            with bind.begin() as conn:
+                for stmt in statements: conn.execute(text(stmt))
+                conn.execute(insert(SchemaMigration).values(version=version, name=name, applied_at=datetime.utcnow()))
+        except IntegrityError:
+            continue  # another worker applied it first
+        applied.append(version)
+    return applied
 
-# Seed admin
-db = SessionLocal()
-if not db.query(User).filter_by(email=ADMIN_EMAIL).first():
-    db.add(User(email=ADMIN_EMAIL, username="admin", password_hash=generate_password_hash(ADMIN_PASSWORD), role="admin"))
-    db.commit()
-db.close()
+def init_db() -> list:
+    """Create missing tables, apply pending migrations and seed the admin account. Safe to re-run.
+
+    Returns the migration versions applied.
+    """
+    Base.metadata.create_all(engine)
+    applied = run_migrations(engine)
+    db = SessionLocal()
+    try:
+        if not db.query(User.id).filter_by(email=ADMIN_EMAIL).first():
+            db.add(User(email=ADMIN_EMAIL, username="admin", password_hash=generate_password_hash(ADMIN_PASSWORD), role="admin"))
+            db.commit()
+    except IntegrityError:
+        db.rollback()  # another worker seeded it first
+    finally:
+        db.close()
+    return applied
+
+_db_ready = set(); _db_lock = threading.Lock()
+def ensure_db():
+    """init_db() once per process and engine; the fast path is a set lookup."""
+    if engine in _db_ready: return
+    with _db_lock:
+        if engine not in _db_ready:
+            init_db(); _db_ready.add(engine)
+
+@bp.before_app_request
+def _auto_init_db():
+    if current_app.config["AUTO_INIT_DB"]: ensure_db()
+
+@bp.cli.command("init-db")
+def init_db_cmd():
+    """Create the schema, apply migrations and seed the admin account."""
+    applied = init_db(); _db_ready.add(engine)
+    click.echo(f"Database ready; applied migration(s): {', '.join(map(str, applied))}." if applied else "Database ready; schema is up to date.")
 
 # Forms
 class SignupForm(FlaskForm):
@@ -156,15 +383,68 @@ class MinesForm(FlaskForm):
     mines = IntegerField("Mines (1–24)", validators=[DataRequired(), NumberRange(min=1, max=24)])
     submit = SubmitField("Open 1 tile")
 
+class AutoBetForm(FlaskForm):
+    bet = FloatField("Bet per round (SOL)", validators=[DataRequired(), NumberRange(min=0.0001)])
+    target_under = IntegerField("Roll under (2–99)", validators=[Optional(), NumberRange(min=2, max=99)])
+    mines = IntegerField("Mines (1–24)", validators=[Optional(), NumberRange(min=1, max=24)])
+    count = IntegerField("Number of rounds", validators=[DataRequired(), NumberRange(min=1, max=AUTOBET_MAX)])
+    stop_loss = FloatField("Stop after losing (SOL)", validators=[Optional(), NumberRange(min=0)])
+    stop_profit = FloatField("Stop after winning (SOL)", validators=[Optional(), NumberRange(min=0)])
+    submit = SubmitField("Start auto-bet")
+
 # Helpers
+UserIdentity = namedtuple("UserIdentity", "id username email role")
+
+class UserCache:
+    """Bounded LRU of UserIdentity tuples with a TTL, shared by the requests of one process.
+
+    Only fields that never change on the bet path are cached; balances and VIP state are always read fresh.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize; self.ttl = ttl
+        self._data = OrderedDict(); self._lock = threading.Lock()
+
+    def get(self, uid: int):
+        if self.ttl <= 0: return None
+        with self._lock:
+            hit = self._data.get(uid)
+            if hit is None: return None
+            if hit[0] < time.monotonic(): del self._data[uid]; return None
+            self._data.move_to_end(uid); return hit[1]
+
+    def put(self, uid: int, ident: UserIdentity):
+        if self.ttl <= 0: return
+        with self._lock:
+            self._data[uid] = (time.monotonic() + self.ttl, ident); self._data.move_to_end(uid)
+            while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def invalidate(self, uid: int):
+        with self._lock: self._data.pop(uid, None)
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
 def current_user():
+    """Identity and role of the logged-in user (a UserIdentity), or None. Load the User row for anything else."""
     uid = session.get("uid")
     if not uid: return None
-    s = SessionLocal(); u = s.query(User).get(uid); s.close(); return u
+    memo = g.get("current_user")
+    if memo and memo[0] == uid: return memo[1]
+    u = user_cache.get(uid)
+    if u is None:
+        s = SessionLocal(); row = s.query(User.id, User.username, User.email, User.role).filter(User.id == uid).first(); s.close()
+        if row is not None: u = UserIdentity(*row); user_cache.put(uid, u)
+    g.current_user = (uid, u); return u
+
+def invalidate_user(uid: int):
+    """Drop the cached identity of a user; call after anything that changes it."""
+    user_cache.invalidate(uid)
+    if has_request_context():
+        memo = g.get("current_user")
+        if memo and memo[0] == uid: g.pop("current_user")
 
 def login_required(view):
     def w(*a, **k):
-        if not current_user(): return redirect(url_for("login"))
+        if not current_user(): return redirect(url_for(".login"))
         return view(*a, **k)
     w.__name__ = view.__name__
     return w
@@ -173,58 +453,823 @@ def admin_required(view):
     def w(*a, **k):
         u = current_user()
         if not u or u.role != "admin":
-            flash("Admin only.", "error"); return redirect(url_for("dashboard"))
+            flash("Admin only.", "error"); return redirect(url_for(".dashboard"))
         return view(*a, **k)
     w.__name__ = view.__name__
     return w
 
-def assign_next_wallet(user_id:int):
-    s = SessionLocal()
-    w = s.query(WalletPool).filter(WalletPool.assigned_user_id==None).order_by(WalletPool.id.asc()).first()
-    if not w: s.close(); return None
-    w.assigned_user_id = user_id; w.assigned_at = datetime.utcnow()
-    s.commit(); addr = w.address; s.close(); return addr
+def claim_wallet(s, user_id: int):
+    """Hand the lowest-id free pool wallet to user_id in one UPDATE ... RETURNING, inside the caller's transaction.
+
+    The free row is found through ix_wallet_pool_assigned_id; on PostgreSQL it is picked with
+    FOR UPDATE SKIP LOCKED so concurrent signups take different rows instead of queueing on one.
+    Returns the address, or None when the pool is empty.
+    """
+    free = select(WalletPool.id).where(WalletPool.assigned_user_id.is_(None)).order_by(WalletPool.id.asc()).limit(1).with_for_update(skip_locked=True).scalar_subquery()
+    return s.execute(
+        update(WalletPool).where(WalletPool.id == free, WalletPool.assigned_user_id.is_(None))
+        .values(assigned_user_id=user_id, assigned_at=datetime.utcnow())
+        .returning(WalletPool.address)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+# Wallet pool import
+WALLET_IMPORT_BATCH = 1000
+BASE58_CHARS = set("123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz")
+def is_valid_wallet(addr: str) -> bool: return 32 <= len(addr) <= 44 and set(addr) <= BASE58_CHARS
+
+def import_wallets(lines, batch_size: int = WALLET_IMPORT_BATCH) -> dict:
+    """Stream CSV lines with a 'wallet' column into the pool in batches.
+
+    Duplicates (already pooled or repeated in the file) are skipped by INSERT ... ON CONFLICT DO NOTHING,
+    so memory stays flat and re-running an import is harmless. Returns added/duplicate/invalid counts.
+    """
+    reader = csv.DictReader(lines)
+    if "wallet" not in (reader.fieldnames or []): raise ValueError("CSV must have a 'wallet' column.")
+    counts = {"added": 0, "duplicate": 0, "invalid": 0}
+    s = SessionLocal(); batch = []
+    def flush():
+        stmt = dialect_insert(s.get_bind())(WalletPool).on_conflict_do_nothing(index_elements=["address"]).returning(WalletPool.id)
+        added = len(s.connection().execute(stmt, [{"address": a} for a in dict.fromkeys(batch)]).all())
+        s.commit()
+        counts["added"] += added; counts["duplicate"] += len(batch) - added; batch.clear()
+    try:
+        for row in reader:
+            addr = (row.get("wallet") or "").strip()
+            if not is_valid_wallet(addr): counts["invalid"] += 1; continue
+            batch.append(addr)
+            if len(batch) >= batch_size: flush()
+        if batch: flush()
+    finally:
+        s.close()
+    return counts
+
+@bp.cli.command("import-wallets")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=WALLET_IMPORT_BATCH, show_default=True)
+def import_wallets_cmd(path, batch_size):
+    """Load a wallet CSV (e.g. wallets.csv) into the wallet pool."""
+    ensure_db()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        counts = import_wallets(f, batch_size)
+    click.echo("Added {added}, duplicate {duplicate}, invalid {invalid}.".format(**counts))
+
+# Keyset pagination over (created_at, id); cursors look like "2024-01-31T12:00:00.000001~42"
+def encode_cursor(ts: datetime, row_id: int) -> str: return f"{ts.isoformat()}~{row_id}"
+
+def decode_cursor(raw):
+    try:
+        ts, row_id = (raw or "").split("~")
+        return datetime.fromisoformat(ts), int(row_id)
+    except ValueError:
+        return None
+
+def _keyset_rows(q, model, c, size: int, desc: bool) -> list:
+    key = tuple_(model.created_at, model.id)
+    if c: q = q.filter(key < tuple_(*c) if desc else key > tuple_(*c))
+    order = (model.created_at.desc(), model.id.desc()) if desc else (model.created_at.asc(), model.id.asc())
+    return q.order_by(*order).limit(size + 1).all()
+
+def keyset_page(q, model, cursor, size: int = ADMIN_PAGE_SIZE, desc: bool = True):
+    """One page of q ordered by (created_at, id); returns (rows, cursor of the next page or None)."""
+    return keyset_page_many([(q, model)], cursor, size, desc)
+
+def keyset_page_many(sources, cursor, size: int = ADMIN_PAGE_SIZE, desc: bool = True):
+    """keyset_page over several (query, model) stores, e.g. hot and archived transactions.
+
+    Each store is paged on its own index and the size + 1 candidates from each are merged,
+    so cost does not grow with the size of either table.
+    """
+    c = decode_cursor(cursor); rows = []
+    for q, model in sources: rows += _keyset_rows(q, model, c, size, desc)
+    if len(sources) > 1: rows.sort(key=lambda r: (r.created_at, r.id), reverse=desc)
+    if len(rows) <= size: return rows, None
+    rows = rows[:size]; return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+# PnL/Wager hourly rollups
+def hour_bucket(ts: datetime) -> datetime: return ts.replace(minute=0, second=0, microsecond=0)
+
+_rollup_upserts = {}
+def rollup_upsert(bind):
+    """The bucket upsert for bind's dialect, built once per dialect."""
+    stmt = _rollup_upserts.get(bind.dialect.name)
+    if stmt is None:
+        ins = dialect_insert(bind)(WagerRollup.__table__)
+        stmt = _rollup_upserts[bind.dialect.name] = ins.on_conflict_do_update(
+            index_elements=["user_id", "game", "bucket"],
+            set_={"bets": WagerRollup.bets + ins.excluded.bets, "wagered": WagerRollup.wagered + ins.excluded.wagered, "pnl": WagerRollup.pnl + ins.excluded.pnl},
+        )
+    return stmt
+
+def record_rollup(s, user_id: int, game: str, bet: float, payout: float, when: datetime | None = None, bets: int = 1):
+    """Add settled bet(s) to the user's hourly bucket; runs inside the caller's transaction."""
+    s.execute(rollup_upsert(s.get_bind()), {"user_id": user_id, "game": game, "bucket": hour_bucket(when or datetime.utcnow()), "bets": bets, "wagered": bet, "pnl": payout - bet})
 
-# PnL/Wager per-bet pairing
 def compute_user_stats(user_id: int):
-    s = SessionLocal()
     now = datetime.utcnow()
     windows = {
         "last_24h": now - timedelta(hours=24),
         "last_7d":  now - timedelta(days=7),
         "last_30d": now - timedelta(days=30),
     }
-    out = {k: {"wagered": 0.0, "pnl": 0.0} for k in windows.keys()}
-    txns = s.query(Transaction).filter(
-        Transaction.user_id == user_id,
-        Transaction.type == "wager"
-    ).order_by(Transaction.created_at.asc()).all()
-    i = 0; n = len(txns)
-    while i < n:
-        t = txns[i]; amt = float(t.amount or 0.0)
-        if amt < 0:
-            bet_time = t.created_at; bet = -amt; payout = 0.0
-            if i + 1 < n:
-                t2 = txns[i+1]
-                if t2.created_at >= bet_time:
-                    payout = float(t2.amount or 0.0); i += 1
-            for key, since in windows.items():
-                if bet_time >= since:
-                    out[key]["wagered"] += bet
-                    out[key]["pnl"] += (-bet + payout)
-        i += 1
-    s.close(); return out
+    cols = []
+    for since in windows.values():
+        hit = WagerRollup.bucket >= hour_bucket(since)
+        cols.append(func.coalesce(func.sum(case((hit, WagerRollup.wagered), else_=0.0)), 0.0))
+        cols.append(func.coalesce(func.sum(case((hit, WagerRollup.pnl), else_=0.0)), 0.0))
+    s = SessionLocal()
+    row = s.query(*cols).filter(WagerRollup.user_id == user_id, WagerRollup.bucket >= hour_bucket(windows["last_30d"])).one()
+    s.close()
+    return {key: {"wagered": float(row[2*i]), "pnl": float(row[2*i+1])} for i, key in enumerate(windows.keys())}
+
+def _load_meta(raw) -> dict:
+    try: info = json.loads(raw or "{}")
+    except ValueError: return {}
+    return info if isinstance(info, dict) else {}
+
+def iter_wager_pairs(s, batch_size: int = 5000):
+    """Stream the wager ledger (archive, then hot) as settled bets: (user_id, created_at, bet, payout, bet_meta, result_meta).
+
+    Per-bet pairing: each debit row is matched with the next credit row of the same user;
+    a debit with no credit after it counts as a lost bet. archive_transactions moves the two rows
+    of a bet together, so pairing never spans the two stores.
+    """
+    for model in LEDGER_MODELS:
+        rows = s.query(model.user_id, model.amount, model.meta, model.created_at).filter(
+            model.type == "wager"
+        ).order_by(model.user_id.asc(), model.created_at.asc(), model.id.asc()).yield_per(batch_size)
+        pending = None
+        for user_id, amount, meta, created_at in rows:
+            amt = float(amount or 0.0)
+            if pending and (pending[0] != user_id or amt < 0 or created_at < pending[1]):
+                yield (*pending[:3], 0.0, pending[3], {}); pending = None
+            if amt < 0:
+                pending = (user_id, created_at, -amt, _load_meta(meta))
+            elif pending:
+                yield (*pending[:3], amt, pending[3], _load_meta(meta)); pending = None
+        if pending: yield (*pending[:3], 0.0, pending[3], {})
+
+def rebuild_rollups(batch_size: int = 5000) -> int:
+    """Recompute every bucket from the wager ledger."""
+    s = SessionLocal()
+    buckets = {}
+    for user_id, when, bet, payout, bet_meta, _ in iter_wager_pairs(s, batch_size):
+        b = buckets.setdefault((user_id, bet_meta.get("game") or "unknown", hour_bucket(when)), [0, 0.0, 0.0])
+        b[0] += int(bet_meta.get("auto") or 1); b[1] += bet; b[2] += payout - bet
+    s.query(WagerRollup).delete()
+    items = [{"user_id": k[0], "game": k[1], "bucket": k[2], "bets": v[0], "wagered": v[1], "pnl": v[2]} for k, v in buckets.items()]
+    for i in range(0, len(items), batch_size):
+        s.execute(insert(WagerRollup), items[i:i+batch_size])
+    s.commit(); s.close(); return len(items)
+
+def bet_record_row(user_id: int, game: str, bet: float, payout: float, bet_meta: dict, result_meta: dict, when: datetime) -> dict:
+    """BetRecord values for a settled bet, taken from the same meta written to the ledger."""
+    wins = result_meta.get("wins")
+    return {
+        "user_id": user_id, "game": game, "rounds": int(bet_meta.get("auto") or 1), "wins": int(wins if wins is not None else payout > 0),
+        "bet": bet, "payout": payout, "mult": result_meta.get("mult"), "roll": result_meta.get("roll"),
+        "target": bet_meta.get("target"), "mines": bet_meta.get("mines"), "created_at": when,
+    }
+
+def rebuild_bet_records(batch_size: int = 5000) -> int:
+    """Replace the bets table with typed rows parsed from the wager ledger's meta JSON."""
+    s = SessionLocal(); rows = []; n = 0
+    s.query(BetRecord).delete()
+    for user_id, when, bet, payout, bet_meta, result_meta in iter_wager_pairs(s, batch_size):
+        rows.append(bet_record_row(user_id, bet_meta.get("game") or "unknown", bet, payout, bet_meta, result_meta, when))
+        if len(rows) >= batch_size: s.execute(insert(BetRecord.__table__), rows); n += len(rows); rows = []
+    if rows: s.execute(insert(BetRecord.__table__), rows); n += len(rows)
+    s.commit(); s.close(); return n
+
+@bp.cli.command("migrate")
+def migrate_cmd():
+    """Create missing tables and apply pending schema migrations."""
+    Base.metadata.create_all(engine)
+    applied = run_migrations(engine)
+    click.echo(f"Applied migration(s): {', '.join(map(str, applied))}" if applied else "Schema is up to date.")
+
+@bp.cli.command("backfill-rollups")
+def backfill_rollups_cmd():
+    """Rebuild wager_rollups from existing wager transactions."""
+    ensure_db()
+    n = rebuild_rollups()
+    click.echo(f"Rebuilt {n} rollup bucket(s).")
+
+@bp.cli.command("backfill-bets")
+def backfill_bets_cmd():
+    """Rebuild the typed bets table from the meta JSON of existing wager transactions."""
+    ensure_db()
+    n = rebuild_bet_records()
+    click.echo(f"Rebuilt {n} bet record(s).")
+
+# Ledger export: rows are streamed off a server-side cursor in yield_per partitions, one output chunk per partition
+EXPORT_BATCH = 5000
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+EXPORT_COLUMNS = ("id", "created_at", "user_id", "email", "type", "amount", "status", "meta")
+
+def parse_export_day(raw, end: bool = False):
+    """'YYYY-MM-DD' or an ISO timestamp; a bare end date includes that whole day. Raises ValueError."""
+    raw = (raw or "").strip()
+    if not raw: return None
+    ts = datetime.fromisoformat(raw)
+    return ts + timedelta(days=1) if end and len(raw) == 10 else ts
+
+def export_query(model, start=None, end=None, user_id=None, tx_type=None, status=None):
+    """model's (Transaction or TransactionArchive) rows in [start, end) with the user's email (None if the user is gone), in id order."""
+    q = select(*(model.__table__.c[c] for c in EXPORT_COLUMNS if c != "email"), User.email).outerjoin(User, User.id == model.user_id)
+    if start: q = q.where(model.created_at >= start)
+    if end: q = q.where(model.created_at < end)
+    if user_id: q = q.where(model.user_id == user_id)
+    if tx_type: q = q.where(model.type == tx_type)
+    if status: q = q.where(model.status == status)
+    return q.order_by(model.id.asc())
+
+def _iter_export_parts(batch_size: int, filters: dict):
+    with engine.connect() as conn:
+        for model in LEDGER_MODELS:
+            yield from conn.execution_options(yield_per=batch_size).execute(export_query(model, **filters)).partitions()
+
+def _export_meta(raw):
+    """meta as a JSON object when it is one, else the stored string untouched (None stays None)."""
+    if raw is None: return None
+    try: info = json.loads(raw)
+    except ValueError: return raw
+    return info if isinstance(info, dict) else raw
+
+def iter_export(fmt: str, batch_size: int = EXPORT_BATCH, **filters):
+    """Yield the filtered ledger (archived rows, then hot rows) as CSV or JSONL text, one chunk per batch_size rows."""
+    buf = io.StringIO(); writer = csv.writer(buf) if fmt == "csv" else None
+    if writer: writer.writerow(EXPORT_COLUMNS); yield buf.getvalue()
+    for part in _iter_export_parts(batch_size, filters):
+        buf.seek(0); buf.truncate()
+        for r in part:
+            row = r._mapping; ts = row["created_at"].isoformat() if row["created_at"] else ""
+            if writer:
+                writer.writerow([row[c] if c != "created_at" else ts for c in EXPORT_COLUMNS])
+            else:
+                buf.write(json.dumps({c: row[c] if c not in ("created_at", "meta") else ts if c == "created_at" else _export_meta(row[c]) for c in EXPORT_COLUMNS}) + "\n")
+        yield buf.getvalue()
+
+@bp.cli.command("export-transactions")
+@click.option("--format", "fmt", type=click.Choice(sorted(EXPORT_FORMATS)), default="csv", show_default=True)
+@click.option("--from", "start", help="first day (YYYY-MM-DD or ISO timestamp)")
+@click.option("--to", "end", help="last day, inclusive (YYYY-MM-DD); an ISO timestamp is an exclusive bound")
+@click.option("--user", "user_id", type=int)
+@click.option("--type", "tx_type")
+@click.option("--status")
+@click.option("--out", type=click.File("w", encoding="utf-8"), default="-", help="output file (default: stdout)")
+@click.option("--batch-size", default=EXPORT_BATCH, show_default=True)
+def export_transactions_cmd(fmt, start, end, user_id, tx_type, status, out, batch_size):
+    """Stream the transaction ledger (filtered) as CSV or JSONL."""
+    ensure_db()
+    try: start, end = parse_export_day(start), parse_export_day(end, end=True)
+    except ValueError as e: raise click.BadParameter(str(e), param_hint="--from/--to")
+    for chunk in iter_export(fmt, batch_size, start=start, end=end, user_id=user_id, tx_type=tx_type, status=status):
+        out.write(chunk)
+
+# Hot/cold archival: settled transactions past ARCHIVE_AFTER_DAYS live in transactions_archive
+ARCHIVE_STATUSES = ("completed", "rejected")  # pending redeems stay hot until an admin settles them
+ARCHIVE_BATCH = 5000
+
+def archive_totals_upsert(bind):
+    ins = dialect_insert(bind)(ArchiveTotal.__table__)
+    return ins.on_conflict_do_update(index_elements=["user_id", "type"], set_={
+        "txns": ArchiveTotal.txns + ins.excluded.txns, "amount": ArchiveTotal.amount + ins.excluded.amount,
+        "through": case((ArchiveTotal.through > ins.excluded.through, ArchiveTotal.through), else_=ins.excluded.through),
+    })
+
+def archive_transactions(days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH) -> int:
+    """Move settled transactions older than `days` into transactions_archive. Returns rows moved.
+
+    Each batch is copied, folded into archive_totals and deleted from the hot table in one
+    transaction, so every row is visible in exactly one store at any time.
+
+    The row holding max(id) always stays hot: SQLite hands out max(rowid) + 1, so moving it
+    would let new transactions reuse ids that already exist in the archive; rows sharing its
+    created_at stay with it.
+
+    Rows are taken in id order, and a wager row is only moved together with its partner (a debit
+    and the next wager row of the same user when that is a credit, as iter_wager_pairs pairs them).
+    Older rows wrote the two with separate timestamps, so a batch or the cutoff can fall between
+    them: the partner is pulled into the batch if it may be archived, otherwise both stay hot.
+    """
+    hot = Transaction.__table__; nb = hot.alias("nb"); cutoff = datetime.utcnow() - timedelta(days=days); moved = 0; last = 0
+    newest = select(hot.c.created_at).where(hot.c.id == select(func.max(hot.c.id)).scalar_subquery()).scalar_subquery()
+    eligible = and_(hot.c.status.in_(ARCHIVE_STATUSES), hot.c.created_at < cutoff, hot.c.created_at < newest)
+    nxt = select(func.min(nb.c.id)).where(nb.c.user_id == hot.c.user_id, nb.c.type == "wager", nb.c.id > hot.c.id).scalar_subquery()
+    prv = select(func.max(nb.c.id)).where(nb.c.user_id == hot.c.user_id, nb.c.type == "wager", nb.c.id < hot.c.id).scalar_subquery()
+    cols = (hot.c.id, hot.c.user_id, hot.c.type, hot.c.amount, hot.c.meta, hot.c.status, hot.c.created_at)
+    partner = case((and_(hot.c.type == "wager", hot.c.amount < 0), nxt), (hot.c.type == "wager", prv)).label("partner")
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select(*cols, partner).where(eligible, hot.c.id > last).order_by(hot.c.id.asc()).limit(batch_size)).all()
+            if not rows: return moved
+            last = rows[-1].id; ids = {r.id for r in rows}
+            want = {r.partner for r in rows if r.partner is not None and r.partner not in ids}
+            found = {p.id: p for p in conn.execute(select(*cols, eligible.label("ok")).where(hot.c.id.in_(want)))} if want else {}
+            batch = []; extra = []
+            for r in rows:
+                p = found.get(r.partner) if r.partner not in ids else None
+                # Only a debit followed by a credit is a pair; anything else has no partner to keep it with
+                if p is None or ((r.amount or 0.0) < 0) == ((p.amount or 0.0) < 0): batch.append(r)
+                elif p.ok: batch.append(r); extra.append(p)
+            batch += {p.id: p for p in extra}.values()
+            if not batch: continue
+            now = datetime.utcnow(); totals = {}
+            conn.execute(insert(TransactionArchive.__table__), [{**{c.name: r._mapping[c.name] for c in cols}, "archived_at": now} for r in batch])
+            for r in batch:
+                tot = totals.setdefault((r.user_id, r.type), [0, 0.0, r.created_at])
+                tot[0] += 1; tot[1] += float(r.amount or 0.0); tot[2] = max(tot[2], r.created_at)
+            conn.execute(archive_totals_upsert(conn), [{"user_id": k[0], "type": k[1], "txns": v[0], "amount": v[1], "through": v[2]} for k, v in totals.items()])
+            conn.execute(hot.delete().where(hot.c.id.in_([r.id for r in batch])))
+        moved += len(batch)
+
+@bp.cli.command("archive-transactions")
+@click.option("--days", type=click.IntRange(min=0), default=ARCHIVE_AFTER_DAYS, show_default=True, help="archive settled transactions older than this")
+@click.option("--batch-size", default=ARCHIVE_BATCH, show_default=True)
+def archive_transactions_cmd(days, batch_size):
+    """Move old settled transactions from transactions into transactions_archive."""
+    ensure_db()
+    n = archive_transactions(days, batch_size)
+    click.echo(f"Archived {n} transaction(s) older than {days} day(s).")
+
+# Game math (10% house edge, server authoritative)
+MINES_BOARD = 25
+def dice_multiplier(target: int) -> float: return (1.0 / (target / 100.0)) * (1.0 - HOUSE_EDGE)
+def mines_multiplier(mines: int) -> float: return (1.0 / ((MINES_BOARD - mines) / MINES_BOARD)) * (1.0 - HOUSE_EDGE)
+def roll_dice() -> int: return max(1, min(100, 1 + int(random.random() * 100)))
+def pick_mines_tile(mines: int) -> bool: return random.random() < (MINES_BOARD - mines) / MINES_BOARD
+
+# Auto-bet: all outcomes are drawn up front, the run is walked once and settled as one bet
+def roll_dice_many(n: int) -> list: return random.choices(range(1, 101), k=n)
+def pick_mines_tiles(mines: int, n: int) -> list: return random.choices((True, False), weights=(MINES_BOARD - mines, mines), k=n)
+
+def run_autobet(bet: float, mult: float, wins: list, balance: float, stop_loss: float | None = None, stop_profit: float | None = None):
+    """Play wins in order until they run out, the balance can't cover the next bet, or a limit is hit.
+
+    Returns (rounds played, total payout, balance needed up front, stop reason). The balance needed
+    is the bet plus the deepest drawdown before any round, so one conditional UPDATE can settle the run.
+    """
+    net = 0.0; low = 0.0; payout = 0.0; played = 0; reason = "count"
+    for win in wins:
+        if balance + net < bet: reason = "balance"; break
+        low = min(low, net)
+        pay = bet * mult if win else 0.0
+        net += pay - bet; payout += pay; played += 1
+        if stop_loss is not None and -net >= stop_loss: reason = "stop_loss"; break
+        if stop_profit is not None and net >= stop_profit: reason = "stop_profit"; break
+    return played, payout, bet - low, reason
+
+# Bet settlement
+def vip_tier_expr(total_wagered):
+    """SQL CASE mirroring compute_vip(), so the tier is updated by the settlement UPDATE itself."""
+    whens = [(total_wagered * BETA_PER_SOL >= thr, name) for thr, name in sorted(VIP_THRESHOLDS_BETA, key=lambda x: x[0], reverse=True)]
+    return case(*whens, else_="None")
+
+# Built once: constructing the VIP CASE per bet costs more than executing it.
+_users = User.__table__
+_wagered = func.coalesce(_users.c.total_wagered, 0.0) + bindparam("bet", type_=Float)
+SETTLE_UPDATE = (
+    update(_users).where(_users.c.id == bindparam("uid"), _users.c.balance_sol >= bindparam("required", type_=Float))
+    .values(balance_sol=_users.c.balance_sol - bindparam("bet", type_=Float) + bindparam("payout", type_=Float), total_wagered=_wagered, vip_tier=vip_tier_expr(_wagered))
+    .returning(_users.c.balance_sol)
+)
+
+def _apply_settlement(s, user_id: int, game: str, bet: float, payout: float, bet_meta: dict, result_meta: dict, when: datetime, bets: int = 1, required: float | None = None, outcomes: str | None = None):
+    """Run one settlement's statements in s without committing. Returns the new balance, or None if it was too low."""
+    row = s.execute(SETTLE_UPDATE, {"uid": user_id, "bet": bet, "payout": payout, "required": bet if required is None else required}).first()
+    if row is None: return None
+    s.execute(insert(Transaction.__table__), [
+        {"user_id": user_id, "type": "wager", "amount": -bet, "meta": json.dumps(bet_meta), "status": "completed", "created_at": when},
+        {"user_id": user_id, "type": "wager", "amount": payout, "meta": json.dumps(result_meta), "status": "completed", "created_at": when},
+    ])
+    s.execute(insert(BetRecord.__table__), bet_record_row(user_id, game, bet, payout, bet_meta, result_meta, when))
+    if outcomes is not None:
+        s.execute(insert(AutoBetRun.__table__), {"user_id": user_id, "game": game, "rounds": bets, "outcomes": outcomes, "created_at": when})
+    record_rollup(s, user_id, game, bet, payout, when, bets)
+    return float(row[0])
+
+def _settle_now(item: tuple):
+    s = SessionLocal()
+    try:
+        balance = _apply_settlement(s, *item)
+        if balance is None: s.rollback()
+        else: s.commit()
+        return balance
+    finally:
+        s.close()
+
+class LedgerWriter:
+    """Group-commit writer: settlements are queued and applied by one background thread,
+    up to max_items per transaction or whatever arrived within flush_ms, so many bets share one commit/fsync.
+
+    Each settlement still runs its own conditional UPDATE, in queue order, so balance checks
+    see every earlier bet, including ones committed in the same batch.
+    """
+    def __init__(self, flush_ms: float, max_items: int):
+        self.flush_s = flush_ms / 1000.0; self.max_items = max_items
+        self._q = queue.Queue(); self._stopping = False; self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True); self._thread.start()
+
+    def submit(self, item: tuple) -> Future:
+        """Queue a settlement; the future resolves to its result once the batch holding it is committed."""
+        fut = Future()
+        with self._lock:
+            if self._stopping: raise RuntimeError("Ledger writer is shut down.")
+            self._q.put((item, fut))
+        return fut
+
+    def stop(self, timeout: float | None = None):
+        """Stop accepting work, flush everything already queued and wait for the thread."""
+        with self._lock:
+            if self._stopping: return
+            self._stopping = True; self._q.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        try: self._loop()
+        finally:
+            # Only reached on shutdown or a bug in the loop itself: refuse new work and fail whatever is left.
+            with self._lock: self._stopping = True
+            while True:
+                try: left = self._q.get_nowait()
+                except queue.Empty: break
+                if left is not None and not left[1].done(): left[1].set_exception(RuntimeError("Ledger writer is shut down."))
+
+    def _loop(self):
+        while True:
+            first = self._q.get()
+            if first is None: return
+            batch = [first]; done = False; deadline = time.monotonic() + self.flush_s
+            while len(batch) < self.max_items:
+                try: nxt = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty: break
+                if nxt is None: done = True; break
+                batch.append(nxt)
+            try: self._flush(batch)
+            except Exception as e:
+                # e.g. rollback/close on a dead connection; fail this batch but keep the writer alive
+                logging.getLogger(__name__).exception("ledger writer batch failed")
+                for _, fut in batch:
+                    if not fut.done(): fut.set_exception(e)
+            if done: return
+
+    def _flush(self, batch: list):
+        s = SessionLocal()
+        try:
+            results = [_apply_settlement(s, *item) for item, _ in batch]
+            s.commit()
+        except Exception:
+            # Don't let one bad settlement fail its neighbours: retry each in its own transaction.
+            s.rollback()
+            for item, fut in batch:
+                try: fut.set_result(_settle_now(item))
+                except Exception as e: fut.set_exception(e)
+            return
+        finally:
+            s.close()
+        for (_, fut), res in zip(batch, results): fut.set_result(res)
+
+_ledger_writer = None
+_ledger_writer_lock = threading.Lock()
+
+def get_ledger_writer() -> LedgerWriter:
+    """Start the writer lazily, so it is created in the worker process rather than a pre-fork master."""
+    global _ledger_writer
+    with _ledger_writer_lock:
+        if _ledger_writer is None:
+            _ledger_writer = LedgerWriter(LEDGER_FLUSH_MS, LEDGER_FLUSH_MAX)
+            atexit.register(_ledger_writer.stop)
+        return _ledger_writer
+
+def settle_bet(user_id: int, game: str, bet: float, payout: float, bet_meta: dict, result_meta: dict, bets: int = 1, required: float | None = None, outcomes: str | None = None):
+    """Debit the bet, credit the payout and write the ledger in one transaction.
+
+    The balance check is part of the UPDATE (balance_sol >= required, which defaults to the bet),
+    so concurrent workers can never overdraw a user. An auto-bet run settles as one bet
+    covering `bets` rounds, with its per-round `outcomes` stored in autobet_runs. With LEDGER_WRITER on, the settlement is group-committed by
+    the background writer; the call still returns only once it is durable, or raises if that takes
+    longer than LEDGER_RESULT_TIMEOUT seconds (the bet may still commit afterwards).
+    Returns the new balance, or None if the balance is too low.
+    """
+    item = (user_id, game, bet, payout, bet_meta, result_meta, datetime.utcnow(), bets, required, outcomes)
+    balance = get_ledger_writer().submit(item).result(LEDGER_RESULT_TIMEOUT) if LEDGER_WRITER else _settle_now(item)
+    if balance is not None: invalidate_user(user_id)
+    return balance
+
+def play_dice(user_id: int, bet: float, target: int):
+    """Roll once and settle. Returns the result, or None if the balance is too low."""
+    mult = dice_multiplier(target); roll = roll_dice()
+    win = (roll < target)
+    payout = bet * mult if win else 0.0
+    balance = settle_bet(user_id, "dice", bet, payout, {"game":"dice","target":target}, {"game":"dice","roll":roll,"result":"win" if win else "lose","mult":round(mult,4)})
+    if balance is None: return None
+    return {"roll": roll, "win": win, "mult": mult, "payout": payout, "balance": balance}
+
+def play_mines(user_id: int, bet: float, mines: int):
+    """Open one tile and settle. Returns the result, or None if the balance is too low."""
+    mult = mines_multiplier(mines); hit_safe = pick_mines_tile(mines)
+    payout = bet * mult if hit_safe else 0.0
+    balance = settle_bet(user_id, "mines", bet, payout, {"game":"mines","mines":mines}, {"game":"mines","result":"safe" if hit_safe else "mine","mult":round(mult,4)})
+    if balance is None: return None
+    return {"safe": hit_safe, "mult": mult, "payout": payout, "balance": balance}
+
+# Multi-step Mines: the board is dealt and the stake debited in one commit; reveals touch only the
+# in-process store, and the round is written again once, when it is cashed out or hits a mine.
+def deal_mines_board(mines: int) -> frozenset: return frozenset(random.sample(range(MINES_BOARD), mines))
+
+def mines_round_multiplier(mines: int, reveals: int) -> float:
+    """Cash-out multiplier after `reveals` safe tiles: prod (25 - i) / (25 - mines - i), less the house edge."""
+    if reveals <= 0: return 1.0  # nothing opened yet: the round is voided and the stake returned
+    mult = 1.0
+    for i in range(reveals): mult *= (MINES_BOARD - i) / (MINES_BOARD - mines - i)
+    return mult * (1.0 - HOUSE_EDGE)
+
+class OpenMinesRound:
+    # ending: outcome decided in memory but not written yet; resumed: this copy was loaded from the database
+    __slots__ = ("id", "user_id", "bet", "mines", "board", "revealed", "touched", "closed", "ending", "resumed", "lock")
+    def __init__(self, round_id: int, user_id: int, bet: float, mines: int, board: frozenset, resumed: bool = False):
+        self.id = round_id; self.user_id = user_id; self.bet = bet; self.mines = mines; self.board = board
+        self.revealed = []; self.touched = time.monotonic(); self.closed = False; self.ending = None; self.resumed = resumed
+        self.lock = threading.Lock()
+
+    @property
+    def mult(self) -> float: return mines_round_multiplier(self.mines, len(self.revealed))
+
+    @property
+    def next_mult(self) -> float: return mines_round_multiplier(self.mines, len(self.revealed) + 1)
+
+class MinesRoundStore:
+    """Open rounds by user id: an LRU bounded to maxsize, with an idle TTL.
+
+    Nothing is dropped silently: put() and expired() hand back the rounds they push out,
+    and the caller cashes them out.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize; self.ttl = ttl
+        self._data = OrderedDict(); self._lock = threading.Lock()
+
+    def get(self, uid: int):
+        with self._lock:
+            rnd = self._data.get(uid)
+            if rnd is not None: rnd.touched = time.monotonic(); self._data.move_to_end(uid)
+            return rnd
+
+    def put(self, rnd: OpenMinesRound) -> list:
+        with self._lock:
+            self._data[rnd.user_id] = rnd; self._data.move_to_end(rnd.user_id)
+            return [self._data.popitem(last=False)[1] for _ in range(len(self._data) - self.maxsize)]
+
+    def discard(self, rnd: OpenMinesRound):
+        with self._lock:
+            if self._data.get(rnd.user_id) is rnd: del self._data[rnd.user_id]
+
+    def expired(self) -> list:
+        """Remove and return the rounds idle for longer than ttl (oldest first, so this stops at the first live one)."""
+        out = []; cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            while self._data:
+                rnd = next(iter(self._data.values()))
+                if rnd.touched > cutoff: break
+                out.append(self._data.popitem(last=False)[1])
+        return out
+
+mines_rounds = MinesRoundStore(MINES_ROUND_MAX, MINES_ROUND_TTL)
+
+def write_mines_outcome(rnd: OpenMinesRound, status: str) -> bool:
+    """Commit the round's outcome on its own, before any money moves. A cash-out before any reveal is
+    written as a void. Returns False if the round was no longer open."""
+    reveals = len(rnd.revealed)
+    if status == "cashed" and not reveals: status = "void"
+    payout = rnd.bet * mines_round_multiplier(rnd.mines, reveals) if status != "bust" else 0.0
+    s = SessionLocal()
+    try:
+        done = s.execute(update(MinesRound).where(MinesRound.id == rnd.id, MinesRound.status == "open").values(
+            status=status, reveals=",".join(map(str, rnd.revealed)), payout=payout).execution_options(synchronize_session=False)).rowcount
+        s.commit()
+    finally:
+        s.close()
+    return bool(done)
+
+def settle_mines_round(round_id: int):
+    """Settle a round whose outcome is written but not booked (closed_at still NULL). The escrowed stake is put back
+    and the round is booked like any other bet (ledger pair, rollup, bet record, VIP); a void is only refunded, so it
+    can't pad wager volume. closed_at is set in the same transaction, so a round settles exactly once.
+    Returns the new balance, or None if it was already settled or settling failed (settle_mines_rounds() retries it)."""
+    s = SessionLocal()
+    try:
+        row = s.get(MinesRound, round_id)
+        if row is None or row.status == "open" or row.closed_at is not None: return None
+        uid, status, bet, mines, payout = row.user_id, row.status, row.bet, row.mines, row.payout
+        reveals = len(row.reveals.split(",")) if row.reveals else 0; when = datetime.utcnow()
+        if not s.execute(update(MinesRound).where(MinesRound.id == round_id, MinesRound.closed_at.is_(None)).values(closed_at=when)
+                         .execution_options(synchronize_session=False)).rowcount:
+            s.rollback(); return None
+        balance = s.execute(update(User).where(User.id == uid).values(balance_sol=User.balance_sol + bet)
+                            .returning(User.balance_sol).execution_options(synchronize_session=False)).scalar()
+        if status != "void":
+            mult = mines_round_multiplier(mines, reveals)
+            balance = _apply_settlement(s, uid, "mines", bet, payout, {"game":"mines","mines":mines,"round":round_id},
+                                        {"game":"mines","result":"cashout" if status == "cashed" else "mine","mult":round(mult,4),"reveals":reveals}, when)
+        if balance is None:
+            s.rollback(); logging.getLogger(__name__).error("Mines round %s could not be settled; will retry", round_id); return None
+        s.commit()
+    except SQLAlchemyError:
+        s.rollback(); logging.getLogger(__name__).exception("Mines round %s could not be settled; will retry", round_id); return None
+    finally:
+        s.close()
+    invalidate_user(uid)
+    return balance
+
+def settle_mines_rounds(user_id: int):
+    """Retry the user's rounds whose outcome was written but whose settlement failed."""
+    s = SessionLocal()
+    ids = s.query(MinesRound.id).filter(MinesRound.user_id == user_id, MinesRound.closed_at.is_(None), MinesRound.status != "open").all(); s.close()
+    for (round_id,) in ids: settle_mines_round(round_id)
+
+def _finish_mines_round(rnd: OpenMinesRound, status: str):
+    """Close rnd at its decided outcome (rnd.ending), else at status. The outcome is written under the round's
+    lock; if that write fails the round stays open and in the store and the error reaches the caller."""
+    with rnd.lock:
+        if rnd.closed: return None
+        written = write_mines_outcome(rnd, rnd.ending or status); rnd.closed = True
+    mines_rounds.discard(rnd)
+    return settle_mines_round(rnd.id) if written else None
+
+def _close_pushed_out(rounds: list):
+    """Cash out rounds pushed out of the store. This runs inside whichever request pushed them, often another
+    user's, so errors are logged rather than raised. A copy this worker only resumed (no reveals here) is dropped
+    instead: another worker may hold the player's reveals, and the round stays open in the database for it."""
+    for rnd in rounds:
+        if rnd.resumed and not rnd.revealed and rnd.ending is None: continue
+        try: _finish_mines_round(rnd, "cashed")
+        except Exception: logging.getLogger(__name__).exception("Mines round %s could not be closed; left open", rnd.id)
+
+def sweep_mines_rounds():
+    """Cash out rounds left idle past MINES_ROUND_TTL."""
+    _close_pushed_out(mines_rounds.expired())
+
+def get_mines_round(user_id: int):
+    """The user's open round: from the store, else resumed from the database (e.g. after a restart, with no reveals)."""
+    sweep_mines_rounds()
+    rnd = mines_rounds.get(user_id)
+    if rnd is not None: return rnd
+    settle_mines_rounds(user_id)
+    s = SessionLocal(); row = s.query(MinesRound).filter(MinesRound.user_id == user_id, MinesRound.status == "open").first(); s.close()
+    if row is None: return None
+    rnd = OpenMinesRound(row.id, user_id, row.bet, row.mines, frozenset(int(x) for x in row.board.split(",")), resumed=True)
+    _close_pushed_out(mines_rounds.put(rnd))
+    return mines_rounds.get(user_id)
+
+def start_mines_round(user_id: int, bet: float, mines: int):
+    """Debit the stake and persist a freshly dealt board. Returns the round, or None if the balance is too low.
+    Raises ValueError when the user already has a round open."""
+    if get_mines_round(user_id) is not None: raise ValueError("Finish your open round first.")
+    board = deal_mines_board(mines); s = SessionLocal()
+    try:
+        if s.execute(update(User).where(User.id == user_id, User.balance_sol >= bet).values(balance_sol=User.balance_sol - bet)
+                     .returning(User.balance_sol).execution_options(synchronize_session=False)).first() is None:
+            s.rollback(); return None
+        row = MinesRound(user_id=user_id, bet=bet, mines=mines, board=",".join(map(str, sorted(board))), status="open")
+        s.add(row); s.commit(); round_id = row.id
+    except IntegrityError:
+        s.rollback(); raise ValueError("Finish your open round first.")  # another request opened one first
+    finally:
+        s.close()
+    invalidate_user(user_id)
+    rnd = OpenMinesRound(round_id, user_id, bet, mines, board)
+    _close_pushed_out(mines_rounds.put(rnd))
+    return rnd
+
+def reveal_mines_tile(user_id: int, tile: int):
+    """Open one tile; memory only unless it ends the round (mine, or every safe tile found).
+    Returns (round, "safe" | "mine" | "cleared"), or None when there is no open round."""
+    rnd = get_mines_round(user_id)
+    if rnd is None: return None
+    with rnd.lock:
+        if rnd.closed: return None
+        if rnd.ending is None:  # else an earlier end failed to write; retry it
+            if tile in rnd.revealed: return rnd, "safe"
+            if tile in rnd.board: rnd.ending = "bust"
+            else:
+                rnd.revealed.append(tile)
+                if len(rnd.revealed) < MINES_BOARD - rnd.mines: return rnd, "safe"
+                rnd.ending = "cashed"
+    # Decided under the lock, so a racing cash-out can't overtake a mine
+    _finish_mines_round(rnd, rnd.ending)
+    return rnd, "mine" if rnd.ending == "bust" else "cleared"
+
+def cash_out_mines_round(user_id: int):
+    """Close the user's round at its current multiplier (a void before any reveal).
+    Returns (round, balance), where balance is None if the round is not settled yet, or None when there is no open round."""
+    rnd = get_mines_round(user_id)
+    if rnd is None: return None
+    return rnd, _finish_mines_round(rnd, "cashed")
+
+# Instrumentation: per-request wall, SQL and template time, aggregated per endpoint for /metrics
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets; self.counts = [0] * (len(buckets) + 1); self.sum = 0.0; self.count = 0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(self.buckets, v)] += 1; self.sum += v; self.count += 1
+
+    def lines(self, name: str, labels: str) -> list:
+        out = []; acc = 0
+        for le, n in zip(self.buckets + ("+Inf",), self.counts):
+            acc += n; out.append(f'{name}_bucket{{{labels},le="{le}"}} {acc}')
+        out.append(f"{name}_sum{{{labels}}} {self.sum:.6f}"); out.append(f"{name}_count{{{labels}}} {self.count}")
+        return out
+
+class RequestMetrics:
+    """Per-endpoint request/SQL/template histograms plus request and query counters, in Prometheus text format."""
+    HISTOGRAMS = (
+        ("request_duration_seconds", "Wall time per request."),
+        ("request_sql_duration_seconds", "Time spent executing SQL per request."),
+        ("request_template_duration_seconds", "Time spent rendering templates per request."),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock(); self._endpoints = {}; self._requests = {}
+
+    def record(self, endpoint: str, status: int, wall: float, sql: float, queries: int, template: float):
+        with self._lock:
+            ep = self._endpoints.get(endpoint)
+            if ep is None: ep = self._endpoints[endpoint] = {"hist": [Histogram() for _ in self.HISTOGRAMS], "queries": 0}
+            for h, v in zip(ep["hist"], (wall, sql, template)): h.observe(v)
+            ep["queries"] += queries
+            self._requests[(endpoint, status)] = self._requests.get((endpoint, status), 0) + 1
+
+    def render(self, prefix: str = "betablockz") -> str:
+        with self._lock:
+            out = [f"# HELP {prefix}_requests_total Requests by endpoint and status.", f"# TYPE {prefix}_requests_total counter"]
+            out += [f'{prefix}_requests_total{{endpoint="{ep}",status="{st}"}} {n}' for (ep, st), n in sorted(self._requests.items())]
+            out += [f"# HELP {prefix}_sql_queries_total SQL statements executed by endpoint.", f"# TYPE {prefix}_sql_queries_total counter"]
+            out += [f'{prefix}_sql_queries_total{{endpoint="{ep}"}} {d["queries"]}' for ep, d in sorted(self._endpoints.items())]
+            for i, (name, help_) in enumerate(self.HISTOGRAMS):
+                out += [f"# HELP {prefix}_{name} {help_}", f"# TYPE {prefix}_{name} histogram"]
+                for ep, d in sorted(self._endpoints.items()): out += d["hist"][i].lines(f"{prefix}_{name}", f'endpoint="{ep}"')
+        return "\n".join(out) + "\n"
+
+request_metrics = RequestMetrics()
+
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    m = g.get("req_metrics") if has_request_context() else None
+    if m is None: return
+    m["sql"] += elapsed; m["queries"] += 1
+    if m["statements"] is not None: m["statements"].append((elapsed, statement))
+
+def _sql_failed(ctx):
+    started = ctx.connection.info.get("query_started") if ctx.connection is not None else None
+    if started: started.pop()
+
+def instrument_engine(eng):
+    event.listen(eng, "before_cursor_execute", _sql_started)
+    event.listen(eng, "after_cursor_execute", _sql_finished)
+    event.listen(eng, "handle_error", _sql_failed)
+
+def _template_started(sender, template, context, **extra):
+    m = g.get("req_metrics")
+    if m is not None: m["template_started"].append(time.perf_counter())
+
+def _template_finished(sender, template, context, **extra):
+    m = g.get("req_metrics")
+    if m is not None and m["template_started"]: m["template"] += time.perf_counter() - m["template_started"].pop()
+
+@bp.before_app_request
+def _start_request_metrics():
+    g.req_metrics = {"started": time.perf_counter(), "sql": 0.0, "queries": 0, "template": 0.0, "template_started": [],
+                     "statements": [] if SLOW_REQUEST_MS > 0 else None}
+
+@bp.after_app_request
+def _finish_request_metrics(response):
+    m = g.pop("req_metrics", None)
+    if m is None: return response
+    wall = time.perf_counter() - m["started"]; endpoint = (request.endpoint or "unmatched").rpartition(".")[2]  # labels without the blueprint prefix
+    request_metrics.record(endpoint, response.status_code, wall, m["sql"], m["queries"], m["template"])
+    if m["statements"] is not None and wall * 1000.0 >= SLOW_REQUEST_MS:
+        worst = sorted(m["statements"], key=lambda x: x[0], reverse=True)[:10]
+        current_app.logger.warning("Slow request %s %s (%s): %.1fms total, %d queries in %.1fms, templates %.1fms\n%s",
+                           request.method, request.path, endpoint, wall * 1000.0, m["queries"], m["sql"] * 1000.0, m["template"] * 1000.0,
+                           "\n".join(f"  {ms * 1000.0:8.2f}ms  {' '.join(stmt.split())[:500]}" for ms, stmt in worst))
+    return response
 
 # Routes
-@app.route("/")
+@bp.route("/")
 def home():
     u = current_user()
-    if u: return redirect(url_for("dashboard"))
+    if u: return redirect(url_for(".dashboard"))
     return render_template("home.html", site_name=SITE_NAME)
 
-@app.route("/signup", methods=["GET","POST"])
+@bp.route("/signup", methods=["GET","POST"])
 def signup():
-    if current_user(): return redirect(url_for("dashboard"))
+    if current_user(): return redirect(url_for(".dashboard"))
     form = SignupForm()
     if form.validate_on_submit():
         if form.invite.data.strip() != INVITE_CODE:
@@ -235,232 +1280,450 @@ def signup():
         if s.query(User).filter_by(username=form.username.data).first():
             flash("Username already taken.", "error"); s.close(); return render_template("signup.html", form=form, site_name=SITE_NAME)
         u = User(email=form.email.data.lower(), username=form.username.data, password_hash=generate_password_hash(form.password.data), role="user", balance_sol=0.0)
-        s.add(u); s.commit()
-        addr = assign_next_wallet(u.id)
-        if addr: u.wallet_address = addr; s.commit()
-        s.close(); flash("Account created. Please log in.", "success"); return redirect(url_for("login"))
+        try:
+            s.add(u); s.flush()
+            u.wallet_address = claim_wallet(s, u.id)
+            s.commit()
+        except IntegrityError:
+            s.rollback(); s.close(); flash("Email or username already in use.", "error"); return render_template("signup.html", form=form, site_name=SITE_NAME)
+        s.close(); flash("Account created. Please log in.", "success"); return redirect(url_for(".login"))
     return render_template("signup.html", form=form, site_name=SITE_NAME)
 
-@app.route("/login", methods=["GET","POST"])
+@bp.route("/login", methods=["GET","POST"])
 def login():
-    if current_user(): return redirect(url_for("dashboard"))
+    if current_user(): return redirect(url_for(".dashboard"))
     form = LoginForm()
     if form.validate_on_submit():
         s = SessionLocal(); u = s.query(User).filter_by(email=form.email.data.lower()).first()
         if u and check_password_hash(u.password_hash, form.password.data):
-            session["uid"] = u.id; s.close(); return redirect(url_for("dashboard"))
+            session["uid"] = u.id; s.close(); return redirect(url_for(".dashboard"))
         s.close(); flash("Invalid credentials.", "error")
     return render_template("login.html", form=form, site_name=SITE_NAME)
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
-    session.pop("uid", None); return redirect(url_for("home"))
+    session.pop("uid", None); return redirect(url_for(".home"))
 
-@app.route("/dashboard")
+@bp.route("/dashboard")
 @login_required
 def dashboard():
-    u = current_user()
-    s = SessionLocal(); tx = s.query(Transaction).filter_by(user_id=u.id).order_by(Transaction.created_at.desc()).limit(30).all(); s.close()
+    s = SessionLocal(); u = s.get(User, current_user().id)
+    tx, _ = keyset_page_many([(s.query(m).filter(m.user_id == u.id), m) for m in LEDGER_MODELS], None, size=30); s.close()
     return render_template("dashboard.html", user=u, txns=tx, site_name=SITE_NAME)
 
-@app.route("/redeem", methods=["POST"])
+@bp.route("/redeem", methods=["POST"])
 @login_required
 def redeem():
     u = current_user(); form = RedeemForm()
     if form.validate_on_submit():
         amount = float(form.amount.data)
-        if amount <= 0: flash("Amount must be positive.", "error"); return redirect(url_for("dashboard"))
-        s = SessionLocal(); uu = s.query(User).get(u.id)
-        if uu.balance_sol < amount: s.close(); flash("Insufficient balance.", "error"); return redirect(url_for("dashboard"))
-        uu.balance_sol -= amount
+        if amount <= 0: flash("Amount must be positive.", "error"); return redirect(url_for(".dashboard"))
+        s = SessionLocal()
+        debited = s.execute(update(User).where(User.id == u.id, User.balance_sol >= amount).values(balance_sol=User.balance_sol - amount)
+                            .execution_options(synchronize_session=False)).rowcount
+        if not debited: s.rollback(); s.close(); flash("Insufficient balance.", "error"); return redirect(url_for(".dashboard"))
         s.add(Transaction(user_id=u.id, type="redeem", amount=-amount, meta=json.dumps({"wallet_to": form.wallet_to.data, "note":"manual payout up to 24h"}), status="pending"))
-        s.commit(); s.close()
+        s.commit(); s.close(); invalidate_user(u.id)
         flash("Redeem request submitted. Manual processing up to 24 hours.", "success")
     else:
         flash("Invalid redeem form.", "error")
-    return redirect(url_for("dashboard"))
+    return redirect(url_for(".dashboard"))
 
-@app.route("/game/dice", methods=["GET","POST"])
+@bp.route("/game/dice", methods=["GET","POST"])
 @login_required
 def game_dice():
     u = current_user(); form = DiceForm(); result = None
     if form.validate_on_submit():
         bet = float(form.bet.data); target = int(form.target_under.data)
-        if bet <= 0 or target < 2 or target > 99: flash("Invalid bet/target.", "error"); return redirect(url_for("game_dice"))
-        s = SessionLocal(); uu = s.query(User).get(u.id)
-        if uu.balance_sol < bet: s.close(); flash("Insufficient balance.", "error"); return redirect(url_for("game_dice"))
-        uu.balance_sol -= bet
-        uu.total_wagered = (uu.total_wagered or 0.0) + bet
-        uu.vip_tier = compute_vip(uu.total_wagered)
-        s.add(Transaction(user_id=u.id, type="wager", amount=-bet, meta=json.dumps({"game":"dice","target":target})))
-        p = target / 100.0; fair = 1.0 / p; mult = fair * (1.0 - HOUSE_EDGE)
-        roll = max(1, min(100, 1 + int(random.random() * 100)))
-        win = (roll < target)
-        payout = bet * mult if win else 0.0
-        if payout > 0:
-            uu.balance_sol += payout
-            s.add(Transaction(user_id=u.id, type="wager", amount=payout, meta=json.dumps({"game":"dice","roll":roll,"result":"win","mult":round(mult,4)})))
-        else:
-            s.add(Transaction(user_id=u.id, type="wager", amount=0.0, meta=json.dumps({"game":"dice","roll":roll,"result":"lose","mult":round(mult,4)})))
-        s.commit(); s.close()
-        result = {"roll": roll, "win": win, "mult": mult, "payout": payout}
-    return render_template("game_dice.html", form=form, user=u, result=result, site_name=SITE_NAME)
+        if bet <= 0 or target < 2 or target > 99: flash("Invalid bet/target.", "error"); return redirect(url_for(".game_dice"))
+        result = play_dice(u.id, bet, target)
+        if result is None: flash("Insufficient balance.", "error"); return redirect(url_for(".game_dice"))
+    return render_template("game_dice.html", form=form, auto_form=AutoBetForm(prefix="auto"), user=u, result=result, site_name=SITE_NAME)
 
-@app.route("/game/mines", methods=["GET","POST"])
+@bp.route("/game/mines", methods=["GET","POST"])
 @login_required
 def game_mines():
     u = current_user(); form = MinesForm(); result = None
     if form.validate_on_submit():
         bet = float(form.bet.data); mines = int(form.mines.data)
-        if bet <= 0 or mines < 1 or mines > 24: flash("Invalid bet/mines.", "error"); return redirect(url_for("game_mines"))
-        s = SessionLocal(); uu = s.query(User).get(u.id)
-        if uu.balance_sol < bet: s.close(); flash("Insufficient balance.", "error"); return redirect(url_for("game_mines"))
-        uu.balance_sol -= bet
-        uu.total_wagered = (uu.total_wagered or 0.0) + bet
-        uu.vip_tier = compute_vip(uu.total_wagered)
-        s.add(Transaction(user_id=u.id, type="wager", amount=-bet, meta=json.dumps({"game":"mines","mines":mines})))
-        BOARD = 25; safe = BOARD - mines; p_safe = safe / BOARD
-        fair = 1.0 / p_safe; mult = fair * (1.0 - HOUSE_EDGE)
-        hit_safe = (random.random() < p_safe)
-        payout = bet * mult if hit_safe else 0.0
-        if payout > 0:
-            uu.balance_sol += payout
-            s.add(Transaction(user_id=u.id, type="wager", amount=payout, meta=json.dumps({"game":"mines","result":"safe","mult":round(mult,4)})))
-        else:
-            s.add(Transaction(user_id=u.id, type="wager", amount=0.0, meta=json.dumps({"game":"mines","result":"mine","mult":round(mult,4)})))
-        s.commit(); s.close()
-        result = {"safe": hit_safe, "mult": mult, "payout": payout}
-    return render_template("game_mines.html", form=form, user=u, result=result, site_name=SITE_NAME)
+        if bet <= 0 or mines < 1 or mines > 24: flash("Invalid bet/mines.", "error"); return redirect(url_for(".game_mines"))
+        result = play_mines(u.id, bet, mines)
+        if result is None: flash("Insufficient balance.", "error"); return redirect(url_for(".game_mines"))
+    return render_template("game_mines.html", form=form, auto_form=AutoBetForm(prefix="auto"), round_form=MinesForm(prefix="round", formdata=None),
+                           mines_round=get_mines_round(u.id), mines_board=MINES_BOARD, user=u, result=result, site_name=SITE_NAME)
+
+@bp.route("/game/mines/start", methods=["POST"])
+@login_required
+def game_mines_start():
+    form = MinesForm(prefix="round")
+    if not form.validate_on_submit(): flash("Invalid bet/mines.", "error"); return redirect(url_for(".game_mines"))
+    try:
+        rnd = start_mines_round(current_user().id, float(form.bet.data), int(form.mines.data))
+    except ValueError as e:
+        flash(str(e), "error"); return redirect(url_for(".game_mines"))
+    if rnd is None: flash("Insufficient balance.", "error")
+    return redirect(url_for(".game_mines"))
+
+@bp.route("/game/mines/reveal/<int:tile>", methods=["POST"])
+@login_required
+def game_mines_reveal(tile):
+    if not 0 <= tile < MINES_BOARD: flash("No such tile.", "error"); return redirect(url_for(".game_mines"))
+    res = reveal_mines_tile(current_user().id, tile)
+    if res is None: flash("No open round.", "error"); return redirect(url_for(".game_mines"))
+    rnd, outcome = res
+    if outcome == "mine": flash(f"Mine on tile {tile + 1}! Lost {rnd.bet:.4f} SOL after {len(rnd.revealed)} safe tile(s).", "error")
+    elif outcome == "cleared": flash(f"Board cleared! Paid {rnd.bet * rnd.mult:.4f} SOL (x{rnd.mult:.4f}).", "success")
+    return redirect(url_for(".game_mines"))
+
+@bp.route("/game/mines/cashout", methods=["POST"])
+@login_required
+def game_mines_cashout():
+    res = cash_out_mines_round(current_user().id)
+    if res is None: flash("No open round.", "error"); return redirect(url_for(".game_mines"))
+    rnd, balance = res
+    if balance is None: flash("Cash-out recorded but not settled yet; your balance will update shortly.", "error")
+    elif not rnd.revealed: flash(f"Round voided; {rnd.bet:.4f} SOL returned.", "success")
+    else: flash(f"Cashed out {rnd.bet * rnd.mult:.4f} SOL (x{rnd.mult:.4f}, {len(rnd.revealed)} safe tile(s)).", "success")
+    return redirect(url_for(".game_mines"))
+
+@bp.route("/game/<any(dice, mines):game>/auto", methods=["POST"])
+@login_required
+def game_auto(game):
+    u = current_user(); form = AutoBetForm(prefix="auto")
+    if not form.validate_on_submit(): flash("Invalid auto-bet.", "error"); return redirect(url_for(f".game_{game}"))
+    bet = float(form.bet.data); count = min(int(form.count.data), AUTOBET_MAX)
+    if game == "dice":
+        target = form.target_under.data
+        if target is None: flash("Pick a roll-under target.", "error"); return redirect(url_for(".game_dice"))
+        mult = dice_multiplier(target); outcomes = roll_dice_many(count); wins = [r < target for r in outcomes]
+        bet_meta = {"game":"dice","target":target}
+    else:
+        mines = form.mines.data
+        if mines is None: flash("Pick a number of mines.", "error"); return redirect(url_for(".game_mines"))
+        mult = mines_multiplier(mines); wins = outcomes = pick_mines_tiles(mines, count)
+        bet_meta = {"game":"mines","mines":mines}
+    s = SessionLocal(); balance = s.query(User.balance_sol).filter(User.id == u.id).scalar() or 0.0; s.close()
+    played, payout, required, reason = run_autobet(bet, mult, wins, balance, form.stop_loss.data, form.stop_profit.data)
+    if not played: flash("Insufficient balance.", "error"); return redirect(url_for(f".game_{game}"))
+    # One ledger pair for the whole run with a summary in its meta; per-round outcomes go to autobet_runs
+    bet_meta["auto"] = played
+    result_meta = {"game":game,"auto":played,"mult":round(mult,4),"wins":sum(wins[:played])}
+    record = ",".join(map(str, outcomes[:played])) if game == "dice" else "".join("1" if w else "0" for w in outcomes[:played])
+    if settle_bet(u.id, game, bet * played, payout, bet_meta, result_meta, bets=played, required=required, outcomes=record) is None:
+        flash("Balance changed during auto-bet; nothing was settled. Try again.", "error"); return redirect(url_for(f".game_{game}"))
+    auto_result = {"played": played, "wins": result_meta["wins"], "wagered": bet * played, "payout": payout, "net": payout - bet * played, "reason": reason, "mult": mult}
+    if game == "dice":
+        return render_template("game_dice.html", form=DiceForm(formdata=None), auto_form=form, user=u, result=None, auto_result=auto_result, site_name=SITE_NAME)
+    return render_template("game_mines.html", form=MinesForm(formdata=None), auto_form=form, round_form=MinesForm(prefix="round", formdata=None),
+                           mines_round=get_mines_round(u.id), mines_board=MINES_BOARD, user=u, result=None, auto_result=auto_result, site_name=SITE_NAME)
+
+# JSON API (session cookie auth; no forms or templates on the bet path)
+API_SCHEMAS = {
+    "dice": {"bet": (float, 0.0001, None), "target_under": (int, 2, 99)},
+    "mines": {"bet": (float, 0.0001, None), "mines": (int, 1, 24)},
+}
+API_TXNS_MAX = 200
+
+def api_error(msg: str, status: int = 400): return jsonify({"error": msg}), status
+
+def validate_payload(payload, schema: dict):
+    """Check each schema field is a finite number of the right kind within (min, max). Returns (values, error)."""
+    if not isinstance(payload, dict): return None, "Expected a JSON object."
+    out = {}
+    for name, (kind, lo, hi) in schema.items():
+        v = payload.get(name)
+        try: ok = not isinstance(v, bool) and isinstance(v, (int, float)) and math.isfinite(v) and (kind is float or v == int(v))
+        except OverflowError: ok = False
+        if not ok: return None, f"'{name}' must be {'a number' if kind is float else 'an integer'}."
+        v = kind(v)
+        if (lo is not None and v < lo) or (hi is not None and v > hi): return None, f"'{name}' is out of range."
+        out[name] = v
+    return out, None
+
+def api_login_required(view):
+    def w(*a, **k):
+        if not current_user(): return api_error("Login required.", 401)
+        return view(*a, **k)
+    w.__name__ = view.__name__
+    return w
+
+@bp.route("/api/v1/dice", methods=["POST"])
+@api_login_required
+def api_dice():
+    data, err = validate_payload(request.get_json(silent=True), API_SCHEMAS["dice"])
+    if err: return api_error(err)
+    result = play_dice(current_user().id, data["bet"], data["target_under"])
+    if result is None: return api_error("Insufficient balance.", 409)
+    return jsonify(result)
+
+@bp.route("/api/v1/mines", methods=["POST"])
+@api_login_required
+def api_mines():
+    data, err = validate_payload(request.get_json(silent=True), API_SCHEMAS["mines"])
+    if err: return api_error(err)
+    result = play_mines(current_user().id, data["bet"], data["mines"])
+    if result is None: return api_error("Insufficient balance.", 409)
+    return jsonify(result)
+
+@bp.route("/api/v1/balance")
+@api_login_required
+def api_balance():
+    s = SessionLocal()
+    balance, wagered, tier = s.query(User.balance_sol, User.total_wagered, User.vip_tier).filter(User.id == current_user().id).one()
+    s.close()
+    return jsonify({"balance_sol": balance or 0.0, "balance_beta": sol_to_beta(balance), "total_wagered": wagered or 0.0, "vip_tier": tier})
 
-@app.route("/claim", methods=["POST"])
+@bp.route("/api/v1/txns")
+@api_login_required
+def api_txns():
+    try: limit = max(1, min(API_TXNS_MAX, int(request.args.get("limit", 50))))
+    except ValueError: return api_error("'limit' must be an integer.")
+    s = SessionLocal()
+    uid = current_user().id
+    sources = [(s.query(m.id, m.type, m.amount, m.status, m.meta, m.created_at).filter(m.user_id == uid), m) for m in LEDGER_MODELS]
+    rows, nxt = keyset_page_many(sources, request.args.get("before"), size=limit)
+    s.close()
+    items = [{"id": r.id, "type": r.type, "amount": r.amount, "status": r.status, "meta": r.meta, "created_at": r.created_at.isoformat()} for r in rows]
+    return jsonify({"items": items, "next": nxt})
+
+@bp.route("/claim", methods=["POST"])
 @login_required
 def claim_code():
     u = current_user()
     code = (request.form.get("claim_code") or "").strip()
     if not code:
-        flash("Enter a code.", "error"); return redirect(url_for("dashboard"))
+        flash("Enter a code.", "error"); return redirect(url_for(".dashboard"))
     s = SessionLocal(); uu = s.query(User).get(u.id)
     if not uu.claim_code or uu.claim_code != code:
-        s.close(); flash("Invalid code.", "error"); return redirect(url_for("dashboard"))
+        s.close(); flash("Invalid code.", "error"); return redirect(url_for(".dashboard"))
     if uu.claim_claimed_at is not None:
-        s.close(); flash("Code already claimed.", "error"); return redirect(url_for("dashboard"))
+        s.close(); flash("Code already claimed.", "error"); return redirect(url_for(".dashboard"))
     amt = float(uu.claim_amount or 0.0)
     if amt <= 0:
-        s.close(); flash("No claim amount set.", "error"); return redirect(url_for("dashboard"))
-    uu.balance_sol = (uu.balance_sol or 0.0) + amt
-    uu.claim_claimed_at = datetime.utcnow()
-    s.add(Transaction(user_id=uu.id, type="bonus", amount=amt, meta=json.dumps({"note":"claimed with code"}), status="completed"))
-    s.commit(); s.close()
+        s.close(); flash("No claim amount set.", "error"); return redirect(url_for(".dashboard"))
+    # one conditional UPDATE, so it can't race a bet or a second claim
+    claimed = s.execute(update(User).where(User.id == u.id, User.claim_code == code, User.claim_claimed_at.is_(None), User.claim_amount == amt)
+                        .values(balance_sol=func.coalesce(User.balance_sol, 0.0) + amt, claim_claimed_at=datetime.utcnow())
+                        .execution_options(synchronize_session=False)).rowcount
+    if not claimed: s.rollback(); s.close(); flash("Code already claimed.", "error"); return redirect(url_for(".dashboard"))
+    s.add(Transaction(user_id=u.id, type="bonus", amount=amt, meta=json.dumps({"note":"claimed with code"}), status="completed"))
+    s.commit(); s.close(); invalidate_user(u.id)
     flash(f"Claimed {amt:.4f} to your balance.", "success")
-    return redirect(url_for("dashboard"))
+    return redirect(url_for(".dashboard"))
 
-@app.route("/admin")
+@bp.route("/admin")
 def admin_index():
     u = current_user()
     if not u or u.role != "admin":
-        flash("Admin only.", "error"); return redirect(url_for("dashboard"))
+        flash("Admin only.", "error"); return redirect(url_for(".dashboard"))
+    q = (request.args.get("q") or "").strip(); role = (request.args.get("role") or "").strip()
+    after = request.args.get("after"); pending_after = request.args.get("pending_after")
     s = SessionLocal()
-    users = s.query(User).order_by(User.created_at.desc()).all()
-    pending = s.query(Transaction).filter_by(status="pending").order_by(Transaction.created_at.asc()).all()
+    uq = s.query(User)
+    if q:
+        like = f"{q}%"
+        uq = uq.filter(or_(User.username.ilike(like), User.email.ilike(like), User.wallet_address == q))
+    if role: uq = uq.filter(User.role == role)
+    users, users_next = keyset_page(uq, User, after)
+    pq = s.query(Transaction).options(joinedload(Transaction.user)).filter(Transaction.status == "pending")
+    pending, pending_next = keyset_page(pq, Transaction, pending_after, desc=False)
+    user_count, balance_sum, wagered_sum = s.query(func.count(User.id), func.coalesce(func.sum(User.balance_sol), 0.0), func.coalesce(func.sum(User.total_wagered), 0.0)).one()
+    pending_count, pending_sum = s.query(func.count(Transaction.id), func.coalesce(func.sum(-Transaction.amount), 0.0)).filter(Transaction.status == "pending", Transaction.type == "redeem").one()
     s.close()
-    return render_template("admin/index.html", users=users, pending=pending, site_name=SITE_NAME)
+    summary = {"users": user_count, "balance": balance_sum, "wagered": wagered_sum, "pending": pending_count, "pending_sum": pending_sum}
+    return render_template("admin/index.html", users=users, pending=pending, summary=summary, q=q, role=role, after=after, pending_after=pending_after,
+                           users_next=users_next, pending_next=pending_next, site_name=SITE_NAME)
 
-@app.route("/admin/user/<int:user_id>", methods=["GET","POST"])
+@bp.route("/admin/user/<int:user_id>", methods=["GET","POST"])
 def admin_user(user_id):
     u = current_user()
     if not u or u.role != "admin":
-        flash("Admin only.", "error"); return redirect(url_for("dashboard"))
+        flash("Admin only.", "error"); return redirect(url_for(".dashboard"))
     s = SessionLocal()
     user = s.query(User).get(user_id)
     if not user:
-        s.close(); flash("User not found.", "error"); return redirect(url_for("admin_index"))
+        s.close(); flash("User not found.", "error"); return redirect(url_for(".admin_index"))
     form = AdjustBalanceForm()
     if form.validate_on_submit():
-        if form.set_amount.data is not None: user.balance_sol = float(form.set_amount.data)
-        if form.add_amount.data is not None: user.balance_sol += float(form.add_amount.data)
-        if form.sub_amount.data is not None:
-            user.balance_sol -= float(form.sub_amount.data)
-            if user.balance_sol < 0: user.balance_sol = 0.0
-        if form.set_wager.data is not None: user.total_wagered = max(0.0, float(form.set_wager.data))
-        if form.add_wager.data is not None: user.total_wagered = max(0.0, (user.total_wagered or 0.0) + float(form.add_wager.data))
-        if form.sub_wager.data is not None: user.total_wagered = max(0.0, (user.total_wagered or 0.0) - float(form.sub_wager.data))
-        user.vip_tier = compute_vip(user.total_wagered or 0.0)
-        if form.set_bonus.data is not None: user.bonus_due = max(0.0, float(form.set_bonus.data))
-        if form.add_bonus.data is not None: user.bonus_due = max(0.0, (user.bonus_due or 0.0) + float(form.add_bonus.data))
-        if form.sub_bonus.data is not None: user.bonus_due = max(0.0, (user.bonus_due or 0.0) - float(form.sub_bonus.data))
+        # Adjustments are SQL expressions over the current row, applied in one UPDATE, so a bet settling
+        # between this page's read and the write isn't overwritten.
+        def floor0(expr): return case((expr < 0, 0.0), else_=expr)
+        balance = func.coalesce(User.balance_sol, 0.0); wager = func.coalesce(User.total_wagered, 0.0); bonus = func.coalesce(User.bonus_due, 0.0)
+        if form.set_amount.data is not None: balance = literal(float(form.set_amount.data))
+        if form.add_amount.data is not None: balance = balance + float(form.add_amount.data)
+        if form.sub_amount.data is not None: balance = floor0(balance - float(form.sub_amount.data))
+        if form.set_wager.data is not None: wager = literal(max(0.0, float(form.set_wager.data)))
+        if form.add_wager.data is not None: wager = floor0(wager + float(form.add_wager.data))
+        if form.sub_wager.data is not None: wager = floor0(wager - float(form.sub_wager.data))
+        if form.set_bonus.data is not None: bonus = literal(max(0.0, float(form.set_bonus.data)))
+        if form.add_bonus.data is not None: bonus = floor0(bonus + float(form.add_bonus.data))
+        if form.sub_bonus.data is not None: bonus = floor0(bonus - float(form.sub_bonus.data))
+        values = {"balance_sol": balance, "total_wagered": wager, "vip_tier": vip_tier_expr(wager), "bonus_due": bonus}
         if form.set_claim_code.data is not None:
-            user.claim_code = (form.set_claim_code.data or '').strip() or None
-            user.claim_claimed_at = None
+            values.update(claim_code=(form.set_claim_code.data or '').strip() or None, claim_claimed_at=None)
         if form.set_claim_amount.data is not None:
-            user.claim_amount = max(0.0, float(form.set_claim_amount.data))
-        s.commit(); flash("Updated.", "success"); s.close(); return redirect(url_for("admin_user", user_id=user_id))
-    txns = s.query(Transaction).filter_by(user_id=user_id).order_by(Transaction.created_at.desc()).all()
+            values["claim_amount"] = max(0.0, float(form.set_claim_amount.data))
+        s.execute(update(User).where(User.id == user_id).values(**values).execution_options(synchronize_session=False))
+        s.commit(); invalidate_user(user_id); flash("Updated.", "success"); s.close(); return redirect(url_for(".admin_user", user_id=user_id))
+    tx_type = (request.args.get("type") or "").strip(); tx_status = (request.args.get("status") or "").strip()
+    sources = []
+    for m in LEDGER_MODELS:
+        tq = s.query(m).filter(m.user_id == user_id)
+        if tx_type: tq = tq.filter(m.type == tx_type)
+        if tx_status: tq = tq.filter(m.status == tx_status)
+        sources.append((tq, m))
+    txns, txns_next = keyset_page_many(sources, request.args.get("before"))
+    archived = s.query(ArchiveTotal).filter(ArchiveTotal.user_id == user_id).order_by(ArchiveTotal.type).all()
     stats = compute_user_stats(user_id)
     s.close()
-    return render_template("admin/user.html", u=user, txns=txns, form=form, stats=stats, site_name=SITE_NAME)
+    return render_template("admin/user.html", u=user, txns=txns, txns_next=txns_next, tx_type=tx_type, tx_status=tx_status, archived=archived, form=form, stats=stats, site_name=SITE_NAME)
 
-@app.route("/admin/user/<int:user_id>/credit_bonus")
+@bp.route("/admin/user/<int:user_id>/credit_bonus")
 def admin_credit_bonus(user_id):
     u = current_user()
     if not u or u.role != "admin":
-        flash("Admin only.", "error"); return redirect(url_for("dashboard"))
+        flash("Admin only.", "error"); return redirect(url_for(".dashboard"))
     s = SessionLocal()
     usr = s.query(User).get(user_id)
     if not usr:
-        s.close(); flash("User not found.", "error"); return redirect(url_for("admin_index"))
+        s.close(); flash("User not found.", "error"); return redirect(url_for(".admin_index"))
     bonus = float(usr.bonus_due or 0.0)
-    if bonus > 0:
-        usr.balance_sol = (usr.balance_sol or 0.0) + bonus
-        usr.bonus_due = 0.0
-        s.add(Transaction(user_id=usr.id, type="bonus", amount=bonus, meta=json.dumps({"note":"admin credited bonus"}), status="completed"))
-        s.commit(); flash(f"Credited {bonus:.4f} to user and reset bonus due.", "success")
+    # compare-and-set on bonus_due: a concurrent credit or bonus edit makes this a no-op instead of a double credit
+    if bonus > 0 and s.execute(update(User).where(User.id == user_id, User.bonus_due == bonus).values(
+            balance_sol=func.coalesce(User.balance_sol, 0.0) + bonus, bonus_due=0.0).execution_options(synchronize_session=False)).rowcount:
+        s.add(Transaction(user_id=user_id, type="bonus", amount=bonus, meta=json.dumps({"note":"admin credited bonus"}), status="completed"))
+        s.commit(); invalidate_user(user_id); flash(f"Credited {bonus:.4f} to user and reset bonus due.", "success")
     else:
         flash("No bonus due to credit.", "error")
-    s.close(); return redirect(url_for("admin_user", user_id=user_id))
+    s.close(); return redirect(url_for(".admin_user", user_id=user_id))
 
-@app.route("/admin/tx/<int:tx_id>/<string:action>")
+@bp.route("/admin/tx/<int:tx_id>/<string:action>")
 def admin_tx_action(tx_id, action):
     u = current_user()
     if not u or u.role != "admin":
-        flash("Admin only.", "error"); return redirect(url_for("dashboard"))
+        flash("Admin only.", "error"); return redirect(url_for(".dashboard"))
     s = SessionLocal(); tx = s.query(Transaction).get(tx_id)
-    if not tx: s.close(); flash("Transaction not found.", "error"); return redirect(url_for("admin_index"))
-    usr = s.query(User).get(tx.user_id)
+    if not tx: s.close(); flash("Transaction not found.", "error"); return redirect(url_for(".admin_index"))
     if action == "complete":
         tx.status = "completed"; s.commit(); flash("Marked completed. Send SOL manually.", "success")
     elif action == "reject":
         if tx.type == "redeem" and tx.status == "pending":
-            usr.balance_sol += (-tx.amount) if tx.amount < 0 else tx.amount
-        tx.status = "rejected"; s.commit(); flash("Redeem rejected. Refunded.", "success")
+            # flip pending -> rejected and refund in one transaction; the status guard stops a double refund
+            refund = abs(tx.amount or 0.0)
+            if s.execute(update(Transaction).where(Transaction.id == tx_id, Transaction.status == "pending").values(status="rejected")
+                         .execution_options(synchronize_session=False)).rowcount:
+                s.execute(update(User).where(User.id == tx.user_id).values(balance_sol=func.coalesce(User.balance_sol, 0.0) + refund)
+                          .execution_options(synchronize_session=False))
+        else:
+            tx.status = "rejected"
+        s.commit(); invalidate_user(tx.user_id); flash("Redeem rejected. Refunded.", "success")
     else:
         flash("Unknown action.", "error")
-    s.close(); return redirect(url_for("admin_index"))
+    s.close(); return redirect(url_for(".admin_index"))
 
-@app.route("/admin/upload_wallets", methods=["GET","POST"])
+@bp.route("/admin/upload_wallets", methods=["GET","POST"])
 def admin_upload_wallets():
     u = current_user()
     if not u or u.role != "admin":
-        flash("Admin only.", "error"); return redirect(url_for("dashboard"))
+        flash("Admin only.", "error"); return redirect(url_for(".dashboard"))
     if request.method == "POST":
         file = request.files.get("csvfile")
         if not file:
-            flash("No file.", "error"); return redirect(url_for("admin_index"))
-        import csv, io
-        s = SessionLocal()
-        f = io.StringIO(file.stream.read().decode("utf-8")); reader = csv.DictReader(f)
-        added = 0
-        for row in reader:
-            addr = (row.get("wallet") or "").strip()
-            if not addr: continue
-            if s.query(WalletPool).filter_by(address=addr).first(): continue
-            s.add(WalletPool(address=addr)); added += 1
-        s.commit(); s.close(); flash(f"Uploaded {added} wallet(s).", "success"); return redirect(url_for("admin_index"))
+            flash("No file.", "error"); return redirect(url_for(".admin_index"))
+        try:
+            counts = import_wallets(io.TextIOWrapper(file.stream, encoding="utf-8-sig", newline=""))
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f"Upload failed: {e}", "error"); return redirect(url_for(".admin_index"))
+        flash("Uploaded {added} wallet(s); {duplicate} duplicate(s), {invalid} invalid row(s) skipped.".format(**counts), "success")
+        return redirect(url_for(".admin_index"))
     form = UploadWalletsForm()
     return render_template("admin/upload_wallets.html", form=form, site_name=SITE_NAME)
 
-@app.template_filter("dt")
+def time_bucket(col, period: str, bind):
+    """col truncated to the hour ('YYYY-MM-DD HH:00') or day ('YYYY-MM-DD') as text, in the bound dialect."""
+    if bind.dialect.name == "postgresql":
+        return func.to_char(func.date_trunc(period, col), "YYYY-MM-DD HH24:00" if period == "hour" else "YYYY-MM-DD")
+    return func.strftime("%Y-%m-%d %H:00" if period == "hour" else "%Y-%m-%d", col)
+
+def house_row(game, rounds, wins, volume, payouts, bucket=None) -> dict:
+    volume = float(volume or 0.0); payouts = float(payouts or 0.0); rounds = int(rounds or 0)
+    return {"bucket": bucket, "game": game, "rounds": rounds, "volume": volume, "payouts": payouts, "ggr": volume - payouts,
+            "rtp": payouts / volume if volume else 0.0, "hit_rate": int(wins or 0) / rounds if rounds else 0.0}
+
+@bp.route("/admin/house")
+def admin_house():
+    u = current_user()
+    if not u or u.role != "admin":
+        flash("Admin only.", "error"); return redirect(url_for(".dashboard"))
+    period = "day" if request.args.get("period") == "day" else "hour"
+    try: days = max(1, min(365, int(request.args.get("days") or (30 if period == "day" else 1))))
+    except ValueError: days = 30 if period == "day" else 1
+    since = datetime.utcnow() - timedelta(days=days)
+    aggs = (func.sum(BetRecord.rounds), func.sum(BetRecord.wins), func.sum(BetRecord.bet), func.sum(BetRecord.payout))
+    s = SessionLocal()
+    bucket = time_bucket(BetRecord.created_at, period, s.get_bind()).label("bucket")
+    rows = s.query(bucket, BetRecord.game, *aggs).filter(BetRecord.created_at >= since).group_by(bucket, BetRecord.game).order_by(bucket.desc(), BetRecord.game).all()
+    totals = s.query(BetRecord.game, *aggs).filter(BetRecord.created_at >= since).group_by(BetRecord.game).order_by(BetRecord.game).all()
+    s.close()
+    rows = [house_row(game, *vals, bucket=b) for b, game, *vals in rows]
+    totals = [house_row(game, *vals) for game, *vals in totals]
+    return render_template("admin/house.html", rows=rows, totals=totals, period=period, days=days, site_name=SITE_NAME)
+
+@bp.route("/admin/export")
+def admin_export():
+    u = current_user()
+    if not u or u.role != "admin":
+        flash("Admin only.", "error"); return redirect(url_for(".dashboard"))
+    fmt = request.args.get("format", "csv")
+    try:
+        if fmt not in EXPORT_FORMATS: raise ValueError(f"unknown format {fmt!r}")
+        start, end = parse_export_day(request.args.get("from")), parse_export_day(request.args.get("to"), end=True)
+        user_id = int(request.args.get("user")) if (request.args.get("user") or "").strip() else None
+    except ValueError as e:
+        flash(f"Export failed: {e}", "error"); return redirect(url_for(".admin_index"))
+    filters = {"start": start, "end": end, "user_id": user_id,
+               "tx_type": (request.args.get("type") or "").strip() or None, "status": (request.args.get("status") or "").strip() or None}
+    name = f"transactions-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"
+    return Response(iter_export(fmt, **filters), mimetype=EXPORT_FORMATS[fmt], headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+@bp.route("/metrics")
+def metrics():
+    u = current_user()
+    if not u or u.role != "admin":
+        flash("Admin only.", "error"); return redirect(url_for(".dashboard"))
+    return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@bp.app_template_filter("dt")
 def format_dt(v): return "-" if not v else v.strftime("%Y-%m-%d %H:%M:%S")
 
+def create_app(config: dict | None = None) -> Flask:
+    """Build the Flask app. Cheap: no database connection, schema check or password hash happens here.
+
+    The schema and admin account are set up by `flask init-db` or, with AUTO_INIT_DB, on the first request.
+    The database is per process and always comes from the DATABASE_URL environment variable, so config
+    may not carry a DATABASE_URL of its own.
+    """
+    if config and "DATABASE_URL" in config:
+        raise ValueError("create_app() does not take DATABASE_URL; set the DATABASE_URL environment variable before importing app.")
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = SECRET_KEY
+    # --- TEMP: make login/forms work in hosted envs ---
+    app.config["WTF_CSRF_ENABLED"] = False     # disable CSRF just to confirm the issue
+    app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+    app.config["SESSION_COOKIE_SECURE"] = False
+    # --------------------------------------------------
+    app.config.update(AUTO_INIT_DB=AUTO_INIT_DB)
+    app.config.update(config or {})
+    app.jinja_env.globals.update(fmt_beta=fmt_beta, vip_progress=vip_progress, autobet_max=AUTOBET_MAX)
+    app.json.sort_keys = False  # API responses are built in order; skip the per-response key sort
+    init_engine(DATABASE_URL)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.register_blueprint(bp)
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     import os
     port_str = os.environ.get("PORT")
@@ -0,0 +1,201 @@
+"""Load test / benchmark for the hot paths of app.py.
+
+Builds a synthetic database (users, wager/redeem/bonus history spread over the last N days,
+a wallet pool), then drives the main routes concurrently and prints throughput and
+p50/p95/p99 latency per scenario as JSON.
+
+    python bench.py                                   # temp SQLite DB, in-process Flask test client
+    python bench.py --users 2000 --txns 1000000 --out run.json
+    DATABASE_URL=sqlite:///bench.db python bench.py --generate-only
+    python bench.py --db sqlite:///bench.db --no-generate --url http://localhost:8000
+
+Runs are reproducible for a given --seed (data and request mix; game outcomes use the app's RNG).
+"""
+from __future__ import annotations
+import argparse, json, os, random, sys, tempfile, threading, time
+from datetime import datetime, timedelta
+import http.cookiejar, urllib.error, urllib.parse, urllib.request
+
+BENCH_PASSWORD = "bench-pass"
+ADMIN_EMAIL = "bench-admin@example.com"
+ADMIN_PASSWORD = "bench-admin-pass"
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--db", help="database URL (default: a fresh temp SQLite file)")
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--txns", type=int, default=50000, help="ledger rows to generate")
+    p.add_argument("--wallets", type=int, default=10000, help="unassigned wallet pool size")
+    p.add_argument("--days", type=int, default=60, help="spread of generated history")
+    p.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--scenarios", help="comma-separated subset of scenarios to run")
+    p.add_argument("--url", help="drive a running server at this base URL instead of the in-process test client")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--no-generate", action="store_true", help="reuse the data already in --db")
+    p.add_argument("--generate-only", action="store_true")
+    p.add_argument("--out", help="also write the JSON report to this file")
+    return p.parse_args(argv)
+
+# Synthetic data
+def generate(app_mod, rnd: random.Random, users: int, txns: int, wallets: int, days: int) -> dict:
+    """Bulk-load users, ledger history and a wallet pool with Core inserts, then rebuild the rollups and bet records."""
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+    A = app_mod; t0 = time.perf_counter(); now = datetime.utcnow()
+    pw_hash = generate_password_hash(BENCH_PASSWORD)  # one KDF run shared by every synthetic user
+    s = A.SessionLocal()
+    first_id = (s.query(A.func.max(A.User.id)).scalar() or 0) + 1
+    s.execute(insert(A.User.__table__), [{
+        "email": f"bench{i}@example.com", "username": f"bench{i}", "password_hash": pw_hash, "role": "user",
+        "balance_sol": round(rnd.uniform(50, 500), 4), "total_wagered": 0.0, "vip_tier": "None",
+        "bonus_due": 0.0, "claim_amount": 0.0, "created_at": now - timedelta(days=days),
+    } for i in range(first_id, first_id + users)])
+    user_ids = list(range(first_id, first_id + users))
+    weights = [1.0 / (i + 1) for i in range(users)]  # a few heavy players, a long tail of light ones
+    rows = []; batch = 5000; n = 0
+    def flush():
+        if rows: s.execute(insert(A.Transaction.__table__), rows); rows.clear()
+    while n < txns:
+        uid = rnd.choices(user_ids, weights)[0]
+        when = now - timedelta(seconds=rnd.random() ** 2 * days * 86400)  # denser towards the present
+        kind = rnd.random()
+        if kind < 0.92:
+            game = rnd.choice(("dice", "mines")); bet = round(rnd.uniform(0.01, 2.0), 4)
+            if game == "dice":
+                target = rnd.randint(2, 99); mult = A.dice_multiplier(target); roll = rnd.randint(1, 100); win = roll < target
+                meta = {"game": "dice", "roll": roll, "result": "win" if win else "lose", "mult": round(mult, 4)}
+                bet_meta = {"game": "dice", "target": target}
+            else:
+                mines = rnd.randint(1, 24); mult = A.mines_multiplier(mines); win = rnd.random() < (25 - mines) / 25
+                meta = {"game": "mines", "result": "safe" if win else "mine", "mult": round(mult, 4)}
+                bet_meta = {"game": "mines", "mines": mines}
+            rows.append({"user_id": uid, "type": "wager", "amount": -bet, "meta": json.dumps(bet_meta), "status": "completed", "created_at": when})
+            rows.append({"user_id": uid, "type": "wager", "amount": bet * mult if win else 0.0, "meta": json.dumps(meta), "status": "completed", "created_at": when})
+            n += 2
+        elif kind < 0.97:
+            status = "pending" if when > now - timedelta(days=1) else rnd.choice(("completed", "completed", "rejected"))
+            rows.append({"user_id": uid, "type": "redeem", "amount": -round(rnd.uniform(0.1, 10), 4), "meta": json.dumps({"wallet_to": "bench", "note": "manual payout up to 24h"}), "status": status, "created_at": when})
+            n += 1
+        else:
+            rows.append({"user_id": uid, "type": "bonus", "amount": round(rnd.uniform(0.1, 5), 4), "meta": json.dumps({"note": "admin credited bonus"}), "status": "completed", "created_at": when})
+            n += 1
+        if len(rows) >= batch: flush()
+    flush()
+    s.execute(insert(A.WalletPool.__table__), [{"address": f"bench{first_id}x{i:08d}"} for i in range(wallets)])
+    s.commit(); s.close()
+    buckets = A.rebuild_rollups(); bet_records = A.rebuild_bet_records()
+    return {"users": users, "txns": n, "wallets": wallets, "rollup_buckets": buckets, "bet_records": bet_records, "seconds": round(time.perf_counter() - t0, 3)}
+
+# Clients
+class TestClientDriver:
+    """In-process client; one Flask test client (own cookie jar) per worker."""
+    def __init__(self, app_mod): self.flask_app = app_mod.app
+    def client(self): return _TestClient(self.flask_app.test_client())
+
+class _TestClient:
+    def __init__(self, c): self.c = c
+    def request(self, method, path, data=None):
+        r = self.c.open(path, method=method, data=data); return r.status_code
+
+class HttpDriver:
+    """Client for a running server; urllib with a cookie jar per worker, redirects not followed."""
+    def __init__(self, base_url): self.base = base_url.rstrip("/")
+    def client(self): return _HttpClient(self.base)
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *a, **k): return None
+
+class _HttpClient:
+    def __init__(self, base):
+        self.base = base
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as r: r.read(); return r.status
+        except urllib.error.HTTPError as e:
+            e.read(); return e.code
+
+# Scenarios: (name, logged in as, method, path factory, form data factory, expected status)
+def scenarios(user_ids: list):
+    return [
+        ("login", None, "POST", lambda w: "/login", lambda w: {"email": f"bench{w['uid']}@example.com", "password": BENCH_PASSWORD}, 302),
+        ("dashboard", "player", "GET", lambda w: "/dashboard", None, 200),
+        ("game_dice", "player", "POST", lambda w: "/game/dice", lambda w: {"bet": "0.01", "target_under": str(w["rnd"].randint(2, 99))}, 200),
+        ("game_mines", "player", "POST", lambda w: "/game/mines", lambda w: {"bet": "0.01", "mines": str(w["rnd"].randint(1, 24))}, 200),
+        ("admin", "admin", "GET", lambda w: "/admin", None, 200),
+        ("admin_house", "admin", "GET", lambda w: "/admin/house?period=day&days=30", None, 200),
+        ("admin_user", "admin", "GET", lambda w: f"/admin/user/{w['rnd'].choice(user_ids)}", None, 200),
+    ]
+
+def percentile(sorted_vals: list, pct: float) -> float:
+    if not sorted_vals: return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(pct / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+def run_scenario(driver, scenario, user_ids: list, requests: int, concurrency: int, seed: int) -> dict:
+    name, who, method, path_fn, data_fn, expected = scenario
+    lat = []; errors = [0]; lock = threading.Lock(); counter = [0]
+    def worker(widx):
+        uid = user_ids[widx % len(user_ids)]
+        c = driver.client(); w = {"uid": uid, "rnd": random.Random(seed * 1000 + widx)}
+        if who == "admin": c.request("POST", "/login", {"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+        elif who == "player": c.request("POST", "/login", {"email": f"bench{uid}@example.com", "password": BENCH_PASSWORD})
+        mine = []; errs = 0
+        while True:
+            with lock:
+                if counter[0] >= requests: break
+                counter[0] += 1
+            if who is None: c.request("GET", "/logout")  # time a real credential check, not the already-logged-in redirect
+            t = time.perf_counter()
+            status = c.request(method, path_fn(w), data_fn(w) if data_fn else None)
+            mine.append((time.perf_counter() - t) * 1000.0)
+            if status != expected: errs += 1
+        with lock: lat.extend(mine); errors[0] += errs
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for th in threads: th.start()
+    for th in threads: th.join()
+    wall = time.perf_counter() - t0; lat.sort()
+    return {
+        "requests": len(lat), "errors": errors[0], "seconds": round(wall, 4),
+        "throughput_rps": round(len(lat) / wall, 2) if wall > 0 else 0.0,
+        "mean_ms": round(sum(lat) / len(lat), 3) if lat else 0.0,
+        "p50_ms": round(percentile(lat, 50), 3), "p95_ms": round(percentile(lat, 95), 3), "p99_ms": round(percentile(lat, 99), 3),
+        "max_ms": round(lat[-1], 3) if lat else 0.0,
+    }
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.db: os.environ["DATABASE_URL"] = args.db
+    elif "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='betablox-bench-'), 'bench.db')}"
+    os.environ.setdefault("ADMIN_EMAIL", ADMIN_EMAIL); os.environ.setdefault("ADMIN_PASSWORD", ADMIN_PASSWORD)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_mod
+    app_mod.ensure_db()
+    rnd = random.Random(args.seed); random.seed(args.seed)
+    report = {"config": {k: v for k, v in vars(args).items() if k != "out"}, "database": os.environ["DATABASE_URL"].split("@")[-1], "started_at": datetime.utcnow().isoformat()}
+    if not args.no_generate: report["dataset"] = generate(app_mod, rnd, args.users, args.txns, args.wallets, args.days)
+    if args.generate_only:
+        print(json.dumps(report, indent=2)); return 0
+    s = app_mod.SessionLocal()
+    user_ids = [i for (i,) in s.query(app_mod.User.id).filter(app_mod.User.username.like("bench%")).order_by(app_mod.User.id).all()]
+    s.close()
+    if not user_ids: print("No bench users in the database; run without --no-generate first.", file=sys.stderr); return 1
+    driver = HttpDriver(args.url) if args.url else TestClientDriver(app_mod)
+    wanted = set(args.scenarios.split(",")) if args.scenarios else None
+    report["scenarios"] = {}
+    for sc in scenarios(user_ids):
+        if wanted and sc[0] not in wanted: continue
+        report["scenarios"][sc[0]] = run_scenario(driver, sc, user_ids, args.requests, args.concurrency, args.seed)
+    out = json.dumps(report, indent=2)
+    print(out)
+    if args.out:
+        with open(args.out, "w") as f: f.write(out + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())